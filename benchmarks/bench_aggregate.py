@@ -0,0 +1,57 @@
+# bench_aggregate.py
+#
+# Compares the per-row iterrows path that write_consolidated_json used to take with the
+# grouped aggregation engine, and checks that both produce the same JSON.
+
+import argparse
+import json
+import time
+from tqdm import tqdm
+from synthetic import make_bdc_frame, make_county_mapping
+from aggregate import aggregate_bdc_data, build_provider_map, encode_speed_tiers
+from writeout import transform_bdc_locations, merge_provider_data
+
+def legacy_provider_map(bdc_data, county_mapping):
+    provider_map = {}
+    for _, row in tqdm(bdc_data.iterrows(), desc="Processing records", total=len(bdc_data)):
+        merge_provider_data(provider_map, transform_bdc_locations([row], county_mapping))
+    return provider_map
+
+def engine_provider_map(bdc_data, county_mapping):
+    return build_provider_map(aggregate_bdc_data(bdc_data, county_mapping))
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark BDC aggregation before and after the groupby engine.')
+    parser.add_argument('--rows', type=int, default=50000, help='Synthetic rows for the legacy comparison')
+    parser.add_argument('--engine-rows', type=int, default=2000000, help='Synthetic rows for the engine-only run')
+    parser.add_argument('--providers', type=int, default=50)
+    parser.add_argument('--counties', type=int, default=67)
+    parser.add_argument('--tiers', type=int, default=40)
+    args = parser.parse_args()
+
+    county_mapping = make_county_mapping(args.counties)
+    bdc_data = make_bdc_frame(args.rows, args.providers, args.counties, args.tiers)
+
+    legacy, legacy_seconds = timed(legacy_provider_map, bdc_data, county_mapping)
+    engine, engine_seconds = timed(engine_provider_map, bdc_data, county_mapping)
+    identical = json.dumps(legacy, indent=2, default=encode_speed_tiers) == json.dumps(engine, indent=2, default=encode_speed_tiers)
+
+    print(f"rows={args.rows} legacy: {legacy_seconds:.2f}s ({args.rows / legacy_seconds:,.0f} rows/s)")
+    print(f"rows={args.rows} engine: {engine_seconds:.2f}s ({args.rows / engine_seconds:,.0f} rows/s)")
+    print(f"speedup: {legacy_seconds / engine_seconds:,.1f}x, identical JSON: {identical}")
+
+    if args.engine_rows:
+        bdc_data = make_bdc_frame(args.engine_rows, args.providers, args.counties, args.tiers)
+        _, engine_seconds = timed(engine_provider_map, bdc_data, county_mapping)
+        print(f"rows={args.engine_rows} engine: {engine_seconds:.2f}s ({args.engine_rows / engine_seconds:,.0f} rows/s)")
+
+    if not identical:
+        raise SystemExit("Engine output differs from the legacy path")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# bench_formats.py
+#
+# File size, write time and load time of the consolidated output as nested JSON against the flat
+# Parquet and Arrow tables. Flat outputs are loaded both as the tier table and rebuilt into the
+# nested provider map. The tier table is generated once and each format runs in its own
+# interpreter, since Linux carries ru_maxrss across fork/exec.
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import pandas as pd
+from synthetic import make_bdc_frame, make_county_mapping
+from aggregate import aggregate_bdc_data
+from writeout import write_providers, iter_merged_providers, find_latest_output
+from tables import write_tier_table, read_tier_table, load_provider_map, get_table_output_file
+
+FORMATS = {
+    'json': 2,
+    'json-compact': None,
+    'parquet': 'parquet',
+    'arrow': 'arrow'
+}
+
+def run_format(output_format, tier_path, output_dir):
+    tier_table = pd.read_pickle(tier_path)
+    start = time.perf_counter()
+    if output_format.startswith('json'):
+        write_providers(iter_merged_providers(tier_table, {}), output_dir, output_dir, FORMATS[output_format])
+        output_file = find_latest_output(output_dir)
+    else:
+        output_file = get_table_output_file(output_dir, output_format)
+        write_tier_table(tier_table, output_file, output_format)
+    write_seconds = time.perf_counter() - start
+    del tier_table
+
+    start = time.perf_counter()
+    if output_format.startswith('json'):
+        with open(output_file, 'r') as f:
+            json.load(f)
+        loads = f"json.load {time.perf_counter() - start:6.2f}s"
+    else:
+        read_tier_table(output_file)
+        table_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        load_provider_map(output_file)
+        loads = f"tier table {table_seconds:6.2f}s, nested map {time.perf_counter() - start:6.2f}s"
+    size_mb = os.path.getsize(output_file) / 1024 ** 2
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{output_format:>12}: {size_mb:8,.1f} MB, write {write_seconds:6.2f}s, load {loads}, peak RSS {peak_mb:,.0f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the JSON, Parquet and Arrow output formats.')
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--providers', type=int, default=2000)
+    parser.add_argument('--counties', type=int, default=300)
+    parser.add_argument('--mode', choices=['generate'] + list(FORMATS), help=argparse.SUPPRESS)
+    parser.add_argument('--tier-path', help=argparse.SUPPRESS)
+    parser.add_argument('--output-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode == 'generate':
+        bdc_data = make_bdc_frame(args.rows, args.providers, args.counties)
+        pd.to_pickle(aggregate_bdc_data(bdc_data, make_county_mapping(args.counties)), args.tier_path)
+        return
+    if args.mode:
+        run_format(args.mode, args.tier_path, args.output_dir)
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tier_path = os.path.join(temp_dir, 'tiers.pkl')
+        common = ['--rows', str(args.rows), '--providers', str(args.providers), '--counties', str(args.counties), '--tier-path', tier_path]
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', 'generate'] + common, check=True)
+        print(f"rows={args.rows} providers={args.providers} counties={args.counties} speed tiers={len(pd.read_pickle(tier_path))}")
+        for output_format in FORMATS:
+            output_dir = os.path.join(temp_dir, output_format)
+            os.makedirs(output_dir)
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', output_format, '--output-dir', output_dir] + common,
+                           check=True, stderr=subprocess.DEVNULL)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# bench_ingest.py
+#
+# Peak-memory comparison of BDC ingestion: the old read-everything-and-concat path against
+# the chunked reader feeding aggregate_bdc_chunks. Data generation and each mode run in their
+# own interpreter: Linux carries ru_maxrss across fork/exec, so the parent must stay small.
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import pandas as pd
+from synthetic import write_bdc_files, make_county_mapping
+from aggregate import aggregate_bdc_data, aggregate_bdc_chunks
+from readin import iter_bdc_chunks
+
+STATE_DIR = os.path.join('USA_FCC-bdc', '12_FL_Florida')
+
+def legacy_combine(bdc_dir):
+    combined_df = pd.DataFrame()
+    for bdc_file in sorted(os.listdir(bdc_dir)):
+        df = pd.read_csv(os.path.join(bdc_dir, bdc_file), compression='zip', encoding='ISO-8859-1')
+        combined_df = pd.concat([combined_df, df], ignore_index=True)
+    combined_df['block_geoid'] = combined_df['block_geoid'].apply(lambda x: str(int(x)).zfill(15))
+    return combined_df[['frn', 'provider_id', 'brand_name', 'location_id', 'technology',
+                        'max_advertised_download_speed', 'max_advertised_upload_speed',
+                        'low_latency', 'business_residential_code', 'state_usps',
+                        'block_geoid', 'h3_res8_id']]
+
+def run_mode(mode, base_dir, counties, chunksize):
+    county_mapping = make_county_mapping(counties)
+    start = time.perf_counter()
+    if mode == 'legacy':
+        tier_table = aggregate_bdc_data(legacy_combine(os.path.join(base_dir, STATE_DIR)), county_mapping)
+    else:
+        tier_table = aggregate_bdc_chunks(iter_bdc_chunks(base_dir, 'FL', chunksize), county_mapping)
+    seconds = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{mode}: {seconds:.2f}s, peak RSS {peak_mb:,.0f} MB, {len(tier_table)} speed tiers")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark peak memory of BDC ingestion.')
+    parser.add_argument('--rows', type=int, default=3000000)
+    parser.add_argument('--files', type=int, default=3)
+    parser.add_argument('--counties', type=int, default=67)
+    parser.add_argument('--chunk-size', type=int, default=250000)
+    parser.add_argument('--mode', choices=['generate', 'legacy', 'streaming'], help=argparse.SUPPRESS)
+    parser.add_argument('--base-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode == 'generate':
+        write_bdc_files(os.path.join(args.base_dir, STATE_DIR), args.rows, args.files, counties=args.counties)
+        return
+    if args.mode:
+        run_mode(args.mode, args.base_dir, args.counties, args.chunk_size)
+        return
+
+    with tempfile.TemporaryDirectory() as base_dir:
+        print(f"rows={args.rows} files={args.files} chunk_size={args.chunk_size}")
+        for mode in ('generate', 'legacy', 'streaming'):
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', mode, '--base-dir', base_dir,
+                            '--rows', str(args.rows), '--files', str(args.files),
+                            '--counties', str(args.counties), '--chunk-size', str(args.chunk_size)], check=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# bench_query.py
+#
+# Load time and query latency of the query layer against a generated consolidated output:
+# reloading the whole JSON for every lookup (what a fresh service process does) against one
+# QueryIndex load followed by uncached and cached queries, in-process and over local HTTP.
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from synthetic import make_bdc_frame, make_county_mapping
+from aggregate import aggregate_bdc_data
+from writeout import write_providers, iter_merged_providers, find_latest_output
+from query import QueryIndex, QUERY_FILTERS, parse_filter, make_server
+
+def percentiles(seconds):
+    seconds = sorted(seconds)
+    pick = lambda fraction: seconds[min(len(seconds) - 1, int(fraction * len(seconds)))] * 1000
+    return f"mean {sum(seconds) / len(seconds) * 1000:8.3f} ms  p50 {pick(0.5):8.3f} ms  p95 {pick(0.95):8.3f} ms"
+
+def timed(queries, run):
+    seconds = []
+    for filters in queries:
+        start = time.perf_counter()
+        run(filters)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+def scan_county(output_file, county):
+    # Reload-and-walk, as without the query layer
+    with open(output_file, 'r') as f:
+        provider_map = json.load(f)
+    return [(provider, technologies) for provider, provider_data in provider_map.items()
+            for state_data in provider_data["states"].values()
+            for county_key, county_data in state_data["counties"].items() if county_key == county
+            for technologies in county_data["technologies"]]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark loading and querying a consolidated output.')
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--providers', type=int, default=2000)
+    parser.add_argument('--counties', type=int, default=300)
+    parser.add_argument('--queries', type=int, default=500, help='Queries per measurement')
+    parser.add_argument('--reloads', type=int, default=3, help='Reload-per-lookup queries to time')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tier_table = aggregate_bdc_data(make_bdc_frame(args.rows, args.providers, args.counties), make_county_mapping(args.counties))
+        write_providers(iter_merged_providers(tier_table, {}), temp_dir, temp_dir)
+        output_file = find_latest_output(temp_dir)
+        print(f"rows={args.rows} providers={args.providers} counties={args.counties} "
+              f"speed tiers={len(tier_table)} output {os.path.getsize(output_file) / 1024 ** 2:,.1f} MB")
+
+        start = time.perf_counter()
+        index = QueryIndex.load(output_file)
+        print(f"{'QueryIndex.load':>24}: {time.perf_counter() - start:8.3f}s for {len(index.offerings):,} county offerings")
+
+        random.seed(0)
+        counties = index.keys('counties')
+        technologies = [None] + sorted({key.split(', ')[0] for key in index.keys('technologies')})
+        queries = [{"county": random.choice(counties), "technology": random.choice(technologies), "min_download": random.choice([0, 25, 100])}
+                   for _ in range(args.queries)]
+
+        print(f"{'reload per lookup':>24}: {percentiles(timed(queries[:args.reloads], lambda filters: scan_county(output_file, filters['county'])))}")
+        print(f"{'query, uncached':>24}: {percentiles(timed(queries, lambda filters: index.encode_query(*(parse_filter(name, filters.get(name)) for name in QUERY_FILTERS))))}")
+        timed(queries, lambda filters: index.lookup(**filters))
+        print(f"{'query, cached':>24}: {percentiles(timed(queries, lambda filters: index.lookup(**filters)))}")
+
+        server = make_server(index, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/query?"
+        get = lambda filters: urllib.request.urlopen(url + urllib.parse.urlencode(
+            {name: value for name, value in filters.items() if value is not None})).read()
+        print(f"{'HTTP, cached':>24}: {percentiles(timed(queries, get))}")
+        server.shutdown()
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# bench_resources.py
+#
+# Startup and lookup cost of the shared resources: building the county and holder lookups from the
+# source files against loading the pickled resource cache, and resolving each record's county and
+# state with the old per-record lookups against the precomputed dense county index.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from constant import STATES_AND_TERRITORIES
+from resources import load_resources, load_county_mapping
+from aggregate import resolve_counties
+import pandas as pd
+
+def write_resources(base_dir, counties_per_state, neighbors, providers):
+    # Same layout as the FCC/Census downloads: one adjacency line per county and neighbor
+    resources_dir = os.path.join(base_dir, 'USA_FCC-bdc', 'resources')
+    os.makedirs(resources_dir)
+    with open(os.path.join(resources_dir, 'county_adjacency2024.txt'), 'w') as f:
+        f.write("County Name|County GEOID|Neighboring County Name|Neighboring GEOID|Length\n")
+        for fips, abbr, name in STATES_AND_TERRITORIES:
+            for county in range(1, counties_per_state + 1):
+                for neighbor in range(neighbors):
+                    f.write(f"County {county:03d}, {abbr}|{fips}{county:03d}|County {neighbor:03d}, {abbr}|{fips}{neighbor:03d}|1000\n")
+    pd.DataFrame({
+        'provider_id': np.arange(100000, 100000 + providers),
+        'holding_company': [f"Holding {i}" for i in range(providers)]
+    }).to_csv(os.path.join(resources_dir, 'bdc_us_provider_list_D23_01jan2025.csv'), index=False)
+
+def legacy_resolve(block_geoids, county_mapping):
+    # The per-record lookups transform_bdc_locations used to do: a dict probe and a scan of the state table
+    keys = []
+    for block_geoid in block_geoids:
+        state_fips, county_name = county_mapping.get(block_geoid[:5], (None, None))
+        state_name = next((name for fips, abbr, name in STATES_AND_TERRITORIES if fips == state_fips), None)
+        keys.append(None if state_name is None else (f"{state_name}, {state_fips}", f"{county_name}, {state_fips}"))
+    return keys
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark resource loading and per-record county lookups.')
+    parser.add_argument('--counties-per-state', type=int, default=60)
+    parser.add_argument('--neighbors', type=int, default=7)
+    parser.add_argument('--providers', type=int, default=3000)
+    parser.add_argument('--records', type=int, default=1000000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as base_dir:
+        write_resources(base_dir, args.counties_per_state, args.neighbors, args.providers)
+        _, build_seconds = timed(load_resources, base_dir)
+        resources, cached_seconds = timed(load_resources, base_dir)
+        print(f"{len(resources.counties)} counties, {len(resources.holder_mapping)} providers: "
+              f"build {build_seconds * 1000:.1f}ms, cached load {cached_seconds * 1000:.1f}ms "
+              f"({build_seconds / cached_seconds:.1f}x)")
+        county_mapping = load_county_mapping(base_dir)
+
+    rng = np.random.default_rng(0)
+    geoids = list(county_mapping)
+    picks = rng.integers(0, len(geoids), size=args.records)
+    suffixes = rng.integers(0, 10**10, size=args.records)
+    block_geoids = pd.Series([f"{geoids[p]}{s:010d}" for p, s in zip(picks.tolist(), suffixes.tolist())], dtype=object)
+
+    legacy_sample = block_geoids[:min(args.records, 100000)].tolist()
+    legacy, legacy_seconds = timed(legacy_resolve, legacy_sample, county_mapping)
+    (codes, state_keys, county_keys), dict_seconds = timed(resolve_counties, block_geoids, county_mapping)
+    (dense_codes, dense_state_keys, dense_county_keys), dense_seconds = timed(resolve_counties, block_geoids, resources.counties)
+
+    same = ([(state_keys[c], county_keys[c]) for c in codes.tolist()] ==
+            [(dense_state_keys[c], dense_county_keys[c]) for c in dense_codes.tolist()])
+    per_record = 1e9 / args.records
+    print(f"per record: legacy scan {legacy_seconds * 1e9 / len(legacy_sample):.0f}ns, "
+          f"factorized dict {dict_seconds * per_record:.0f}ns, dense index {dense_seconds * per_record:.0f}ns, "
+          f"same keys: {same}")
+
+if __name__ == '__main__':
+    main()
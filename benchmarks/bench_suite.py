@@ -0,0 +1,164 @@
+# bench_suite.py
+#
+# End-to-end benchmark suite on generated data. For each scale it writes a synthetic base
+# directory (BDC files, county_adjacency2024.txt and a provider list), then times read_data,
+# transform_bdc_locations, write_consolidated_json and main.main, each in its own interpreter
+# so peak RSS is per benchmark (Linux carries ru_maxrss across fork/exec). Results are saved
+# as JSON, tagged with the git commit, so runs can be compared across commits with --baseline.
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+import pandas as pd
+from synthetic import write_base_dir
+from readin import read_data
+from resources import load_county_mapping
+from writeout import transform_bdc_locations, write_consolidated_json
+import main as pipeline
+
+BENCHMARKS = ['read_data', 'transform_bdc_locations', 'write_consolidated_json', 'main']
+
+DEFAULT_SCALES = [10_000, 100_000, 1_000_000, 10_000_000]
+
+def read_states(base_dir, states):
+    return [read_data(base_dir, state) for state in states]
+
+def run_benchmark(benchmark, args):
+    # Returns (seconds, rows) for the timed part only; generated data is read back untimed where needed
+    output_dir = os.path.join(args.base_dir, f"output_{benchmark}")
+    os.makedirs(output_dir, exist_ok=True)
+    if benchmark == 'read_data':
+        start = time.perf_counter()
+        frames = read_states(args.base_dir, args.state)
+        return time.perf_counter() - start, sum(len(frame) for frame in frames)
+
+    if benchmark == 'transform_bdc_locations':
+        county_mapping = load_county_mapping(args.base_dir)
+        records = [record for frame in read_states(args.base_dir, args.state) for record in frame.to_dict('records')]
+        start = time.perf_counter()
+        transform_bdc_locations(records, county_mapping)
+        return time.perf_counter() - start, len(records)
+
+    if benchmark == 'write_consolidated_json':
+        frames = read_states(args.base_dir, args.state)
+        start = time.perf_counter()
+        for frame in frames:
+            write_consolidated_json(frame, args.base_dir, output_dir)
+        return time.perf_counter() - start, sum(len(frame) for frame in frames)
+
+    # End to end through the CLI entry point, without the on-disk caches so every commit does the same work
+    sys.argv = ['main.py', '-d', args.base_dir, '-o', output_dir, '-s'] + args.state + ['--no-cache'] + args.main_args.split()
+    start = time.perf_counter()
+    pipeline.main()
+    return time.perf_counter() - start, args.rows
+
+def measure(benchmark, args):
+    seconds, rows = run_benchmark(benchmark, args)
+    print(json.dumps({
+        "seconds": round(seconds, 4),
+        "rows": rows,
+        "rows_per_sec": round(rows / seconds, 1) if seconds > 0 else None,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }))
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_scale(args, rows, temp_dir):
+    base_dir = os.path.join(temp_dir, str(rows))
+    common = ['--base-dir', base_dir, '--rows', str(rows), '--providers', str(args.providers),
+              '--counties', str(args.counties), '--tiers', str(args.tiers), '--files', str(args.files),
+              '--format', args.format, '--main-args', args.main_args, '-s'] + args.state
+    subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', 'generate'] + common, check=True)
+
+    results = []
+    for benchmark in args.benchmarks:
+        result = {"rows": rows, "benchmark": benchmark}
+        if benchmark == 'transform_bdc_locations' and rows > args.transform_max_rows:
+            # The per-record path holds every record as a dict; past this size it only measures swapping
+            result["skipped"] = f"more than --transform-max-rows {args.transform_max_rows}"
+        else:
+            completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', benchmark] + common,
+                                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+            if completed.returncode == 0:
+                result.update(json.loads(completed.stdout.strip().splitlines()[-1]))
+            else:
+                result["error"] = f"exit code {completed.returncode}"
+        results.append(result)
+        print(format_result(result), flush=True)
+    return results
+
+def format_result(result, baseline=None):
+    line = f"{result['benchmark']:>24} rows={result['rows']:>10,}: "
+    if "seconds" not in result:
+        return line + (result.get("skipped") or result.get("error"))
+    line += f"{result['seconds']:9.3f}s {result['rows_per_sec'] or 0:>12,.0f} rows/s  peak RSS {result['peak_rss_mb']:,.0f} MB"
+    if baseline and baseline.get("seconds"):
+        line += f"  ({baseline['seconds'] / result['seconds']:.2f}x vs baseline)"
+    return line
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on generated BDC data at several scales.')
+    parser.add_argument('--scales', type=int, nargs='*', default=DEFAULT_SCALES, help='Total BDC records per run')
+    parser.add_argument('--providers', type=int, default=200)
+    parser.add_argument('--counties', type=int, default=67, help='Counties per state')
+    parser.add_argument('--tiers', type=int, default=40, help='Distinct speed tiers to draw from')
+    parser.add_argument('-s', '--state', nargs='*', default=['FL'])
+    parser.add_argument('--files', type=int, default=3, help='Technology files per state')
+    parser.add_argument('--format', choices=['zip', 'csv'], default='zip')
+    parser.add_argument('--benchmarks', nargs='*', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--transform-max-rows', type=int, default=1_000_000, help='Skip transform_bdc_locations above this many rows')
+    parser.add_argument('--main-args', default='', help='Extra arguments for the end-to-end main run, e.g. "--workers 4"')
+    parser.add_argument('-o', '--output', help='Results file (default: bench_results_<commit>.json)')
+    parser.add_argument('--baseline', help='Results file of an earlier run to compare against')
+    parser.add_argument('--mode', choices=['generate'] + BENCHMARKS, help=argparse.SUPPRESS)
+    parser.add_argument('--base-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--rows', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode == 'generate':
+        write_base_dir(args.base_dir, args.rows, args.providers, args.counties, args.tiers, args.state, args.files, args.format)
+        return
+    if args.mode:
+        measure(args.mode, args)
+        return
+
+    commit = git_commit()
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for rows in args.scales:
+            results.extend(run_scale(args, rows, temp_dir))
+
+    output = args.output or f"bench_results_{commit or 'unknown'}.json"
+    with open(output, 'w') as f:
+        json.dump({
+            "commit": commit,
+            "created": datetime.now().isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "parameters": {key: value for key, value in vars(args).items() if key not in ('mode', 'base_dir', 'rows', 'output', 'baseline')},
+            "results": results
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        previous = {(result["benchmark"], result["rows"]): result for result in baseline["results"]}
+        print(f"Compared with {baseline.get('commit')}:")
+        for result in results:
+            print(format_result(result, previous.get((result["benchmark"], result["rows"]))))
+
+if __name__ == '__main__':
+    main()
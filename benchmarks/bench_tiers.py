@@ -0,0 +1,62 @@
+# bench_tiers.py
+#
+# Micro-benchmark of speed-tier lookups for a single county with many distinct tiers:
+# the linear list scan the aggregation used to do against the hash-indexed SpeedTiers.
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from aggregate import SpeedTiers
+
+def list_scan(records):
+    locations = []
+    for max_download_speed, max_upload_speed, low_latency in records:
+        existing_location = next((loc for loc in locations if loc["max_download_speed"] == max_download_speed and loc["max_upload_speed"] == max_upload_speed and loc["low_latency"] == low_latency), None)
+        if existing_location:
+            existing_location["count"] += 1
+        else:
+            locations.append({
+                "count": 1,
+                "max_download_speed": max_download_speed,
+                "max_upload_speed": max_upload_speed,
+                "low_latency": low_latency
+            })
+    return locations
+
+def indexed(records):
+    tiers = SpeedTiers()
+    for max_download_speed, max_upload_speed, low_latency in records:
+        tiers.add(max_download_speed, max_upload_speed, low_latency)
+    return tiers.to_list()
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark speed-tier lookups in one synthetic county.')
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--tiers', type=int, nargs='*', default=[10, 100, 1000, 5000])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for tier_count in args.tiers:
+        downloads = rng.integers(1, 10000, size=tier_count)
+        uploads = rng.integers(1, 1000, size=tier_count)
+        picks = rng.integers(0, tier_count, size=args.records)
+        records = list(zip(downloads[picks].tolist(), uploads[picks].tolist(), (picks % 2).tolist()))
+
+        start = time.perf_counter()
+        expected = list_scan(records)
+        scan_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = indexed(records)
+        indexed_seconds = time.perf_counter() - start
+
+        print(f"tiers={tier_count:>6} records={args.records}: list scan {scan_seconds:.3f}s, "
+              f"indexed {indexed_seconds:.3f}s ({scan_seconds / indexed_seconds:,.0f}x), same result: {expected == result}")
+
+if __name__ == '__main__':
+    main()
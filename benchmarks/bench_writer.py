@@ -0,0 +1,76 @@
+# bench_writer.py
+#
+# Time and peak RSS of writing the consolidated JSON: the old approach (build the whole
+# provider map, then json.dump(indent=2)) against the streaming writer in its indented,
+# compact and gzip modes. The tier table is generated once and each mode runs in its own
+# interpreter, since Linux carries ru_maxrss across fork/exec.
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import pandas as pd
+from synthetic import make_bdc_frame, make_county_mapping
+from aggregate import aggregate_bdc_data, build_provider_map, encode_speed_tiers
+from writeout import write_providers, iter_merged_providers, find_latest_output
+
+MODES = {
+    'json.dump': None,
+    'stream': (2, None),
+    'stream-compact': (None, None),
+    'stream-gzip': (2, 'gzip'),
+    'stream-compact-gzip': (None, 'gzip')
+}
+
+def run_mode(mode, tier_path, output_dir):
+    tier_table = pd.read_pickle(tier_path)
+    baseline_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    if MODES[mode] is None:
+        provider_map = build_provider_map(tier_table)
+        output_file = os.path.join(output_dir, 'fccbdcsum_legacy.json')
+        with open(output_file, 'w') as f:
+            json.dump(provider_map, f, indent=2, default=encode_speed_tiers)
+    else:
+        indent, compression = MODES[mode]
+        write_providers(iter_merged_providers(tier_table, {}), output_dir, output_dir, indent, compression)
+        output_file = find_latest_output(output_dir)
+    seconds = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    size_mb = os.path.getsize(output_file) / 1024 ** 2
+    print(f"{mode:>20}: {seconds:6.2f}s, peak RSS {peak_mb:,.0f} MB (+{peak_mb - baseline_mb:,.0f} MB over the loaded tier table), file {size_mb:,.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the consolidated JSON writers.')
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--providers', type=int, default=2000)
+    parser.add_argument('--counties', type=int, default=300)
+    parser.add_argument('--mode', choices=['generate'] + list(MODES), help=argparse.SUPPRESS)
+    parser.add_argument('--tier-path', help=argparse.SUPPRESS)
+    parser.add_argument('--output-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode == 'generate':
+        bdc_data = make_bdc_frame(args.rows, args.providers, args.counties)
+        pd.to_pickle(aggregate_bdc_data(bdc_data, make_county_mapping(args.counties)), args.tier_path)
+        return
+    if args.mode:
+        run_mode(args.mode, args.tier_path, args.output_dir)
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tier_path = os.path.join(temp_dir, 'tiers.pkl')
+        common = ['--rows', str(args.rows), '--providers', str(args.providers), '--counties', str(args.counties), '--tier-path', tier_path]
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', 'generate'] + common, check=True)
+        print(f"rows={args.rows} providers={args.providers} counties={args.counties} speed tiers={len(pd.read_pickle(tier_path))}")
+        for mode in MODES:
+            output_dir = os.path.join(temp_dir, mode)
+            os.makedirs(output_dir)
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', mode, '--output-dir', output_dir] + common, check=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+# synthetic.py
+
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from constant import STATES_AND_TERRITORIES
+
+BDC_TECH_CODES = [10, 40, 50, 60, 61, 70, 71, 72, 0]
+
+def make_county_mapping(counties, state_fips="12"):
+    # county_geoid -> (state_fips, county_name), same shape as writeout.load_county_mapping
+    return {f"{state_fips}{i:03d}": (state_fips, f"County {i:03d}") for i in range(1, counties + 1)}
+
+def make_bdc_frame(rows, providers=50, counties=67, tiers=40, state_fips="12", seed=0, technology=None, provider_seed=None):
+    # provider_seed fixes the provider ids, technologies and speed tiers independently of the rows,
+    # so several files can share one provider list; technology pins every row to one code, as in a
+    # per-technology BDC file
+    rng = np.random.default_rng(seed)
+    provider_rng = rng if provider_seed is None else np.random.default_rng(provider_seed)
+    state_abbr = next(abbr for fips, abbr, name in STATES_AND_TERRITORIES if fips == state_fips)
+
+    # Each provider offers a handful of technologies and speed tiers, as in the real filings
+    provider_ids = provider_rng.integers(100000, 999999, size=providers)
+    provider_techs = provider_rng.choice(BDC_TECH_CODES, size=(providers, 2))
+    tier_downloads = provider_rng.choice([10, 25, 50, 100, 250, 300, 500, 940, 1000, 2000], size=tiers)
+    tier_uploads = provider_rng.choice([1, 3, 10, 20, 35, 50, 100, 500, 1000], size=tiers)
+    provider_tiers = provider_rng.integers(0, tiers, size=(providers, min(tiers, 8)))
+
+    provider_idx = rng.integers(0, providers, size=rows)
+    county_idx = rng.integers(1, counties + 1, size=rows)
+    tech_codes = provider_techs[provider_idx, rng.integers(0, 2, size=rows)]
+    if technology is not None:
+        tech_codes = np.full(rows, technology)
+    tier_idx = provider_tiers[provider_idx, rng.integers(0, provider_tiers.shape[1], size=rows)]
+
+    block_suffix = rng.integers(0, 10**10, size=rows)
+    block_geoids = [f"{state_fips}{c:03d}{b:010d}" for c, b in zip(county_idx.tolist(), block_suffix.tolist())]
+
+    return pd.DataFrame({
+        'frn': provider_ids[provider_idx] * 10,
+        'provider_id': provider_ids[provider_idx],
+        'brand_name': np.array([f"Provider {i:04d}" for i in range(providers)], dtype=object)[provider_idx],
+        'location_id': rng.integers(1000000000, 1999999999, size=rows),
+        'technology': tech_codes,
+        'max_advertised_download_speed': tier_downloads[tier_idx],
+        'max_advertised_upload_speed': tier_uploads[tier_idx],
+        'low_latency': (tech_codes != 60).astype(int),
+        'business_residential_code': rng.choice(np.array(["R", "B", "X"], dtype=object), size=rows),
+        'state_usps': state_abbr,
+        'block_geoid': block_geoids,
+        'h3_res8_id': [f"88{h:013x}" for h in rng.integers(0, 16**13, size=rows).tolist()],
+    })
+
+BDC_FILE_TECHNOLOGIES = ['Cable', 'Copper', 'FibertothePremises', 'GSOSatellite', 'LBRFixedWireless',
+                         'LicensedFixedWireless', 'NGSOSatellite', 'Other', 'UnlicensedFixedWireless']
+
+# Technology code of the records in each per-technology BDC file
+BDC_FILE_TECH_CODES = {
+    'Cable': 40, 'Copper': 10, 'FibertothePremises': 50, 'GSOSatellite': 60, 'LBRFixedWireless': 72,
+    'LicensedFixedWireless': 71, 'NGSOSatellite': 61, 'Other': 0, 'UnlicensedFixedWireless': 70
+}
+
+PROVIDER_SEED = 12345
+
+def write_bdc_files(state_dir, rows, files=3, providers=50, counties=67, tiers=40, state_fips="12", seed=0, file_format='zip'):
+    # Writes bdc_XX_<Technology>_fixed_broadband files totalling `rows` records, zipped or as plain csv;
+    # every file draws from the same providers so the provider list matches all of them
+    os.makedirs(state_dir, exist_ok=True)
+    paths = []
+    for i, technology in enumerate(BDC_FILE_TECHNOLOGIES[:files]):
+        file_rows = rows // files + (1 if i < rows % files else 0)
+        bdc_data = make_bdc_frame(file_rows, providers, counties, tiers, state_fips, seed + i,
+                                  BDC_FILE_TECH_CODES[technology], PROVIDER_SEED)
+        name = f"bdc_{state_fips}_{technology}_fixed_broadband"
+        if file_format == 'zip':
+            path = os.path.join(state_dir, f"{name}.zip")
+            bdc_data.to_csv(path, index=False, compression={'method': 'zip', 'archive_name': f"{name}.csv"})
+        else:
+            path = os.path.join(state_dir, f"{name}.csv")
+            bdc_data.to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+def write_county_adjacency(resources_dir, county_mapping, neighbors=6):
+    # county_adjacency2024.txt lists every county once per neighbouring county
+    geoids = list(county_mapping)
+    with open(os.path.join(resources_dir, 'county_adjacency2024.txt'), 'w') as f:
+        f.write("County Name|County GEOID|Neighboring County Name|Neighboring GEOID|Length\n")
+        for i, county_geoid in enumerate(geoids):
+            state_fips, county_name = county_mapping[county_geoid]
+            for offset in range(-(neighbors // 2), neighbors - neighbors // 2 + 1):
+                neighbor_geoid = geoids[(i + offset) % len(geoids)]
+                f.write(f"{county_name}|{county_geoid}|{county_mapping[neighbor_geoid][1]}|{neighbor_geoid}|{abs(offset) * 1000}\n")
+
+def write_provider_list(resources_dir, providers):
+    # bdc_us_provider_list_*.csv with a holding company for each synthetic provider id
+    provider_ids = np.random.default_rng(PROVIDER_SEED).integers(100000, 999999, size=providers)
+    pd.DataFrame({
+        'provider_id': provider_ids,
+        'holding_company': [f"Holding {i // 3:04d}" for i in range(providers)]
+    }).drop_duplicates('provider_id').to_csv(os.path.join(resources_dir, 'bdc_us_provider_list_D23_01jan2025.csv'), index=False)
+
+def write_base_dir(base_dir, rows, providers=50, counties=67, tiers=40, states=('FL',), files=3, file_format='zip', seed=0):
+    # A complete base directory for main.py: resources plus `rows` records split across the states
+    resources_dir = os.path.join(base_dir, 'USA_FCC-bdc', 'resources')
+    os.makedirs(resources_dir, exist_ok=True)
+    county_mapping = {}
+    for i, state_abbr in enumerate(states):
+        fips, abbr, name = next(state for state in STATES_AND_TERRITORIES if state[1] == state_abbr)
+        state_dir = os.path.join(base_dir, 'USA_FCC-bdc', f"{fips}_{abbr}_{name.replace(' ', '_')}")
+        state_rows = rows // len(states) + (1 if i < rows % len(states) else 0)
+        write_bdc_files(state_dir, state_rows, files, providers, counties, tiers, fips, seed + i * files, file_format)
+        county_mapping.update(make_county_mapping(counties, fips))
+    write_county_adjacency(resources_dir, county_mapping)
+    write_provider_list(resources_dir, providers)
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic FCC BDC base directory.')
+    parser.add_argument('-d', '--base-dir', required=True, help='Base directory to create USA_FCC-bdc in')
+    parser.add_argument('--rows', type=int, default=1000000, help='Total records across all states and files')
+    parser.add_argument('--providers', type=int, default=50)
+    parser.add_argument('--counties', type=int, default=67, help='Counties per state')
+    parser.add_argument('--tiers', type=int, default=40, help='Distinct speed tiers to draw from')
+    parser.add_argument('-s', '--state', nargs='*', default=['FL'], help='State abbreviation(s) to generate')
+    parser.add_argument('--files', type=int, default=3, help='Technology files per state')
+    parser.add_argument('--format', choices=['zip', 'csv'], default='zip')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_base_dir(args.base_dir, args.rows, args.providers, args.counties, args.tiers, args.state, args.files, args.format, args.seed)
+
+if __name__ == '__main__':
+    main()
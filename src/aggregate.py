@@ -0,0 +1,290 @@
+# aggregate.py
+
+import logging
+import numpy as np
+import pandas as pd
+from constant import TECH_ABBR_MAPPING
+from resources import CountyIndex, STATE_NAME_BY_FIPS
+
+# Columns of the flat tier table produced by aggregate_bdc_data, in output order
+TIER_TABLE_COLUMNS = ['provider', 'provider_id', 'state', 'county', 'technology', 'location_type',
+                      'max_download_speed', 'max_upload_speed', 'low_latency', 'count']
+
+# Repetitive string columns are stored as categoricals so tier tables stay small when pickled
+CATEGORICAL_COLUMNS = ['provider', 'state', 'county', 'technology', 'location_type']
+
+REQUIRED_BDC_COLUMNS = ['technology', 'brand_name', 'provider_id', 'max_advertised_download_speed',
+                        'max_advertised_upload_speed', 'low_latency', 'business_residential_code',
+                        'block_geoid']
+
+LOCATION_TYPES = ("R", "B", "X")
+
+class SpeedTier:
+    __slots__ = ('count', 'max_download_speed', 'max_upload_speed', 'low_latency')
+
+    def __init__(self, count, max_download_speed, max_upload_speed, low_latency):
+        self.count = count
+        self.max_download_speed = max_download_speed
+        self.max_upload_speed = max_upload_speed
+        self.low_latency = low_latency
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "max_download_speed": self.max_download_speed,
+            "max_upload_speed": self.max_upload_speed,
+            "low_latency": self.low_latency
+        }
+
+class SpeedTiers:
+    # Speed tiers of one location type, keyed by (max_download_speed, max_upload_speed, low_latency).
+    # Serialized as the "locations" list, in the order the tiers were first seen.
+    __slots__ = ('_tiers',)
+
+    def __init__(self):
+        self._tiers = {}
+
+    @classmethod
+    def from_records(cls, records):
+        tiers = cls()
+        for record in records:
+            tiers.add(record["max_download_speed"], record["max_upload_speed"], record["low_latency"], record["count"])
+        return tiers
+
+    def add(self, max_download_speed, max_upload_speed, low_latency, count=1):
+        key = (max_download_speed, max_upload_speed, low_latency)
+        tier = self._tiers.get(key)
+        if tier is None:
+            self._tiers[key] = SpeedTier(count, max_download_speed, max_upload_speed, low_latency)
+        else:
+            tier.count += count
+
+    def merge(self, other):
+        for tier in other:
+            self.add(tier.max_download_speed, tier.max_upload_speed, tier.low_latency, tier.count)
+
+    def get(self, max_download_speed, max_upload_speed, low_latency):
+        return self._tiers.get((max_download_speed, max_upload_speed, low_latency))
+
+    def to_list(self):
+        return [tier.to_dict() for tier in self._tiers.values()]
+
+    def __iter__(self):
+        return iter(self._tiers.values())
+
+    def __len__(self):
+        return len(self._tiers)
+
+def encode_speed_tiers(obj):
+    # json.dump default hook: expands SpeedTiers into the "locations" list only while writing
+    if isinstance(obj, SpeedTiers):
+        return obj.to_list()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def decode_speed_tiers(obj):
+    # json.load object_hook: re-indexes each "locations" list of a previous output
+    locations = obj.get("locations")
+    if isinstance(locations, list):
+        obj["locations"] = SpeedTiers.from_records(locations)
+    return obj
+
+def empty_tier_table():
+    return pd.DataFrame({column: [] for column in TIER_TABLE_COLUMNS})
+
+def resolve_counties(block_geoids, county_mapping):
+    # Look up each distinct county once instead of once per record
+    # Casting to a 5-character unicode array truncates every GEOID to its county prefix in one pass
+    county_geoids = block_geoids.to_numpy().astype(str).astype('U5')
+    if isinstance(county_mapping, CountyIndex):
+        # Precomputed keys: each GEOID indexes the dense county array directly, no hashing or factorizing
+        codes = county_mapping.positions(county_geoids)
+        if codes is not None:
+            return codes, county_mapping.state_keys, county_mapping.county_keys
+    codes, uniques = pd.factorize(county_geoids)
+
+    state_keys = []
+    county_keys = []
+    for county_geoid in uniques:
+        state_fips, county_name = county_mapping.get(county_geoid, (None, None))
+        state_name = STATE_NAME_BY_FIPS.get(state_fips) if state_fips is not None else None
+        if state_name is None:
+            state_keys.append(None)
+            county_keys.append(None)
+            continue
+        state_keys.append(f"{state_name}, {state_fips}")
+        county_keys.append(f"{county_name}, {state_fips}")
+
+    return codes, state_keys, county_keys
+
+def aggregate_bdc_data(bdc_data, county_mapping):
+    missing = [column for column in REQUIRED_BDC_COLUMNS if column not in bdc_data.columns]
+    if missing:
+        logging.error(f"Missing key in BDC location data: {missing}")
+        return empty_tier_table()
+    if bdc_data.empty:
+        return empty_tier_table()
+
+    codes, state_keys, county_keys = resolve_counties(bdc_data['block_geoid'], county_mapping)
+    resolved = np.array([key is not None for key in state_keys] + [False])
+    keep = resolved[codes]  # code -1 (missing geoid) picks the trailing False
+    if not keep.any():
+        return empty_tier_table()
+    kept = bdc_data[keep]
+
+    frame = pd.DataFrame({
+        'provider': kept['brand_name'].to_numpy(),
+        'county_code': codes[keep],
+        'technology': kept['technology'].to_numpy(),
+        'location_type': kept['business_residential_code'].to_numpy(),
+        'max_download_speed': kept['max_advertised_download_speed'].to_numpy(),
+        'max_upload_speed': kept['max_advertised_upload_speed'].to_numpy(),
+        'low_latency': kept['low_latency'].to_numpy(),
+    })
+
+    # Groups come out in order of first appearance, which preserves the key order of the JSON output
+    counts = frame.groupby(list(frame.columns), sort=False, dropna=False).size()
+    tiers = counts.reset_index(name='count')
+
+    # Each provider keeps the provider_id of its first record
+    first_records = kept.drop_duplicates('brand_name')
+    provider_ids = dict(zip(first_records['brand_name'].tolist(), first_records['provider_id'].tolist()))
+
+    county_codes = tiers['county_code'].to_numpy()
+    tech_keys = {tech: f"{TECH_ABBR_MAPPING.get(tech, 'Unknown')}, {tech}" for tech in tiers['technology'].unique().tolist()}
+
+    tier_table = pd.DataFrame({
+        'provider': tiers['provider'],
+        'provider_id': tiers['provider'].map(provider_ids),
+        'state': np.array(state_keys, dtype=object)[county_codes],
+        'county': np.array(county_keys, dtype=object)[county_codes],
+        'technology': tiers['technology'].map(tech_keys),
+        'location_type': tiers['location_type'],
+        'max_download_speed': tiers['max_download_speed'],
+        'max_upload_speed': tiers['max_upload_speed'],
+        'low_latency': tiers['low_latency'],
+        'count': tiers['count'],
+    })
+    return compact_tier_table(tier_table)
+
+def compact_tier_table(tier_table):
+    return tier_table.astype({column: 'category' for column in CATEGORICAL_COLUMNS})
+
+def combine_tier_tables(tier_tables):
+    # Tables must be passed in input order: each group keeps its first position and each provider its first provider_id
+    tier_tables = [tier_table for tier_table in tier_tables if len(tier_table)]
+    if not tier_tables:
+        return empty_tier_table()
+    if len(tier_tables) == 1:
+        return tier_tables[0]
+
+    combined = pd.concat(tier_tables, ignore_index=True)
+    key_columns = [column for column in TIER_TABLE_COLUMNS if column not in ('provider_id', 'count')]
+    counts = combined.groupby(key_columns, sort=False, dropna=False, observed=True)['count'].sum()
+    tiers = counts.reset_index()
+
+    first_records = combined.drop_duplicates('provider')
+    provider_ids = dict(zip(first_records['provider'].tolist(), first_records['provider_id'].tolist()))
+    tiers.insert(1, 'provider_id', tiers['provider'].map(provider_ids))
+    return compact_tier_table(tiers[TIER_TABLE_COLUMNS])
+
+def group_reduce(keys, sums=(), maxes=()):
+    # NumPy groupby over integer key columns, returned in ascending key order. Each key becomes a dense
+    # order-preserving code (an offset for narrow ranges like technology codes, a sorted factorize for
+    # sparse ones like H3 cells) and the codes are packed into one int64, so a single argsort orders
+    # the rows; runs of equal keys are then summed/maxed with reduceat.
+    if len(keys[0]) == 0:
+        return list(keys), list(sums), list(maxes)
+    packed = np.zeros(len(keys[0]), dtype=np.int64)
+    capacity = 1
+    for key in keys:
+        low = key.min()
+        span = int(key.max()) - int(low) + 1
+        if span <= max(len(key), 1 << 16):
+            codes = key - low
+        else:
+            codes, uniques = pd.factorize(key, sort=True)
+            span = len(uniques)
+        capacity *= span
+        if capacity >= 2 ** 63:
+            raise OverflowError(f"Too many distinct key combinations to pack into int64: {capacity}")
+        packed = packed * span + codes
+    order = np.argsort(packed)
+    packed = packed[order]
+    starts = np.flatnonzero(np.concatenate(([True], packed[1:] != packed[:-1])))
+    return ([key[order][starts] for key in keys],
+            [np.add.reduceat(values[order], starts) for values in sums],
+            [np.maximum.reduceat(values[order], starts) for values in maxes])
+
+def aggregate_bdc_chunks(chunks, county_mapping, fold_every=16):
+    # Aggregates each chunk as it arrives and folds the partial tier tables together periodically,
+    # so only one raw chunk is ever held in memory
+    partials = []
+    records = 0
+    for chunk in chunks:
+        records += len(chunk)
+        partials.append(aggregate_bdc_data(chunk, county_mapping))
+        if len(partials) >= fold_every:
+            partials = [combine_tier_tables(partials)]
+    tier_table = combine_tier_tables(partials)
+    logging.info(f"Aggregated {records} records into {len(tier_table)} speed tiers")
+    return tier_table
+
+def new_tech_data():
+    return {
+        "total_locations": 0,
+        "R": {
+            "total_locations": 0,
+            "locations": SpeedTiers()
+        },
+        "B": {
+            "total_locations": 0,
+            "locations": SpeedTiers()
+        },
+        "X": {
+            "total_locations": 0,
+            "locations": SpeedTiers()
+        }
+    }
+
+def build_provider_map(tier_table, provider_map=None):
+    if provider_map is None:
+        provider_map = {}
+
+    rows = zip(*(tier_table[column].tolist() for column in TIER_TABLE_COLUMNS))
+    for provider, provider_id, state_key, county_key, tech_key, location_type, max_download_speed, max_upload_speed, low_latency, count in rows:
+        provider_data = provider_map.get(provider)
+        if provider_data is None:
+            provider_data = provider_map[provider] = {
+                "provider_id": provider_id,
+                "states": {}
+            }
+
+        state_data = provider_data["states"].get(state_key)
+        if state_data is None:
+            state_data = provider_data["states"][state_key] = {
+                "counties": {}
+            }
+
+        county_data = state_data["counties"].get(county_key)
+        if county_data is None:
+            county_data = state_data["counties"][county_key] = {
+                "total_locations": 0,
+                "technologies": {}
+            }
+
+        tech_data = county_data["technologies"].get(tech_key)
+        if tech_data is None:
+            tech_data = county_data["technologies"][tech_key] = new_tech_data()
+
+        county_data["total_locations"] += count
+        tech_data["total_locations"] += count
+        if location_type not in LOCATION_TYPES:
+            logging.error(f"Missing key in BDC location data: {location_type!r}")
+            continue
+
+        loc_data = tech_data[location_type]
+        loc_data["total_locations"] += count
+
+        loc_data["locations"].add(max_download_speed, max_upload_speed, low_latency, count)
+
+    return provider_map
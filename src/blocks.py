@@ -0,0 +1,195 @@
+# blocks.py
+
+import os
+import re
+import json
+import logging
+import pandas as pd
+from datetime import datetime
+from constant import TABBLOCK20_FILE_PATTERN, TECH_ABBR_MAPPING
+from resources import get_state_info, get_resources_dir
+
+try:
+    import geopandas as gpd
+    import shapely
+except ImportError:  # geopandas is only needed for block-level output
+    gpd = None
+
+# Only these tabblock20 attributes are read; pyogrio skips the other columns entirely
+TABBLOCK20_COLUMNS = ['GEOID20', 'HOUSING20', 'POP20']
+
+BLOCK_KEY_COLUMNS = ['block_geoid', 'technology', 'provider_id', 'brand_name', 'max_advertised_download_speed',
+                     'max_advertised_upload_speed', 'low_latency', 'business_residential_code']
+
+# Technology keys every feature carries, empty where the block has no service of that technology
+BLOCK_TECHNOLOGIES = list(dict.fromkeys(TECH_ABBR_MAPPING.values()))
+
+# Key of technology codes missing from TECH_ABBR_MAPPING; only added to a state's features if it has any
+UNKNOWN_TECHNOLOGY = 'Unknown'
+
+BLOCK_FORMATS = {
+    'gpkg': 'GPKG',
+    'geojson': 'GeoJSON'
+}
+
+def find_tabblock_file(base_dir, state_abbr):
+    # tl_XX_tabblock20.(shp|zip) for the state, looked up in the state directory first, then in resources
+    fips, abbr, name = get_state_info(state_abbr)
+    for directory in (os.path.join(base_dir, 'USA_FCC-bdc', f"{fips}_{abbr}_{name}"), get_resources_dir(base_dir)):
+        if not os.path.exists(directory):
+            continue
+        for filename in sorted(os.listdir(directory)):
+            if re.match(TABBLOCK20_FILE_PATTERN, filename) and filename[3:5] == fips:
+                return os.path.join(directory, filename)
+    raise FileNotFoundError(f"No tabblock20 file for state {state_abbr} matching {TABBLOCK20_FILE_PATTERN}")
+
+def read_tabblocks(tabblock_file, bbox=None):
+    # Arrow-backed pyogrio read of just the columns the features carry, optionally clipped to a bbox
+    return gpd.read_file(tabblock_file, engine='pyogrio', use_arrow=True, columns=TABBLOCK20_COLUMNS,
+                         bbox=tuple(bbox) if bbox is not None else None)
+
+def aggregate_block_chunk(chunk):
+    counts = chunk.groupby(BLOCK_KEY_COLUMNS, sort=False, dropna=False, observed=True).size()
+    return counts.reset_index(name='locations')
+
+def combine_block_tables(block_tables):
+    block_tables = [block_table for block_table in block_tables if len(block_table)]
+    if not block_tables:
+        return pd.DataFrame({column: [] for column in BLOCK_KEY_COLUMNS + ['locations']})
+    if len(block_tables) == 1:
+        return block_tables[0]
+    combined = pd.concat(block_tables, ignore_index=True)
+    counts = combined.groupby(BLOCK_KEY_COLUMNS, sort=False, dropna=False, observed=True)['locations'].sum()
+    return counts.reset_index()
+
+def block_properties(block_table, holder_mapping):
+    # {block_geoid: {tech abbr: {field: [...], ...}}}, with an empty object for technologies the block lacks.
+    # Rows are sorted once so each block's entries are built in one linear pass.
+    block_table = block_table.sort_values(['block_geoid', 'technology'], kind='stable')
+    properties = {}
+    rows = zip(*(block_table[column].tolist() for column in BLOCK_KEY_COLUMNS + ['locations']))
+    for block_geoid, tech, provider_id, brand_name, max_download_speed, max_upload_speed, low_latency, location_type, locations in rows:
+        techs = properties.get(block_geoid)
+        if techs is None:
+            techs = properties[block_geoid] = {abbr: {} for abbr in BLOCK_TECHNOLOGIES}
+        abbr = TECH_ABBR_MAPPING.get(tech, UNKNOWN_TECHNOLOGY)
+        entry = techs.get(abbr)
+        if not entry:
+            # Same key order as example.geojson
+            entry = techs[abbr] = {
+                "holding_company": [],
+                "locations": [],
+                "provider_id": [],
+                "brand_name": [],
+                "technology": tech,
+                "technology_description": abbr,
+                "max_advertised_download_speed": [],
+                "max_advertised_upload_speed": [],
+                "low_latency": [],
+                "business_residential_code": []
+            }
+        # Providers missing from the provider list keep their brand name as the holding company
+        entry["holding_company"].append(holder_mapping.get(provider_id, brand_name))
+        entry["locations"].append(locations)
+        entry["provider_id"].append(provider_id)
+        entry["brand_name"].append(brand_name)
+        entry["max_advertised_download_speed"].append(max_download_speed)
+        entry["max_advertised_upload_speed"].append(max_upload_speed)
+        entry["low_latency"].append(low_latency)
+        entry["business_residential_code"].append(location_type)
+    return properties
+
+def block_technologies(properties):
+    # Technology keys of a state's features, the same for the GeoJSON properties and the GeoPackage columns
+    if any(UNKNOWN_TECHNOLOGY in techs for techs in properties.values()):
+        return BLOCK_TECHNOLOGIES + [UNKNOWN_TECHNOLOGY]
+    return BLOCK_TECHNOLOGIES
+
+def get_block_output_file(output_dir, state_abbr, block_format):
+    return os.path.join(output_dir, f"fccbdcblk_{state_abbr}_{datetime.now().strftime('%m%d%Y')}.{block_format}")
+
+def write_block_geojson(blocks, properties, output_file, technologies=BLOCK_TECHNOLOGIES):
+    # Streams the FeatureCollection so nested technology objects stay objects, as in example.geojson;
+    # geometries are encoded in one vectorized shapely call
+    if blocks.crs is not None and blocks.crs.to_epsg() != 4326:
+        blocks = blocks.to_crs(4326)
+    geometries = shapely.to_geojson(blocks.geometry.values)
+    unserved = {abbr: {} for abbr in technologies}
+    with open(output_file, 'w') as f:
+        f.write('{"type": "FeatureCollection", "features": [')
+        columns = zip(blocks.index.tolist(), *(blocks[column].tolist() for column in TABBLOCK20_COLUMNS))
+        for i, ((feature_id, geoid, housing, population), geometry) in enumerate(zip(columns, geometries)):
+            feature_properties = {"GEOID20": geoid, "HOUSING20": housing, "POP20": population}
+            feature_properties.update(unserved)
+            feature_properties.update(properties.get(geoid, {}))
+            f.write(f'{"," if i else ""}\n{{"id": {json.dumps(str(feature_id))}, "type": "Feature", '
+                    f'"properties": {json.dumps(feature_properties)}, "geometry": {geometry}}}')
+        f.write('\n]}\n')
+
+def write_block_gpkg(blocks, properties, output_file, layer, technologies=BLOCK_TECHNOLOGIES):
+    # GeoPackage attributes are flat, so each technology entry is stored as a JSON text column
+    blocks = blocks.copy()
+    for abbr in technologies:
+        blocks[abbr] = pd.array([json.dumps(properties[geoid][abbr]) if geoid in properties and properties[geoid].get(abbr) else None
+                                 for geoid in blocks['GEOID20'].tolist()], dtype='string')
+    blocks.to_file(output_file, driver=BLOCK_FORMATS['gpkg'], engine='pyogrio', layer=layer, use_arrow=True)
+
+class BlockWriter:
+    # Collects per-block location counts from the chunks of one state as they stream past, then joins them
+    # to the state's tl_XX_tabblock20 blocks by GEOID20 and writes a GeoPackage and/or GeoJSON per state
+    stage = 'blocks'
+
+    def __init__(self, base_dir, output_dir=None, holder_mapping=None, formats=tuple(BLOCK_FORMATS), bbox=None, fold_every=16):
+        if gpd is None:
+            raise ImportError("Block-level output requires geopandas and pyogrio: pip install geopandas pyogrio")
+        self.base_dir = base_dir
+        self.output_dir = output_dir if output_dir is not None else os.path.join(base_dir, 'USA_FCC-bdc')
+        self.holder_mapping = holder_mapping or {}
+        self.formats = formats
+        self.bbox = bbox
+        self.fold_every = fold_every
+        self.partials = []
+        self.tabblock_file = None
+
+    def check(self, state_abbr):
+        # Run before the state is read, so a missing tabblock20 file skips the blocks instead of failing after aggregation
+        self.tabblock_file = find_tabblock_file(self.base_dir, state_abbr)
+
+    def collect(self, chunks):
+        self.partials = []
+        for chunk in chunks:
+            self.partials.append(aggregate_block_chunk(chunk))
+            if len(self.partials) >= self.fold_every:
+                self.partials = [combine_block_tables(self.partials)]
+            yield chunk
+
+    def write(self, state_abbr):
+        block_table = combine_block_tables(self.partials)
+        self.partials = []
+        properties = block_properties(block_table, self.holder_mapping)
+        technologies = block_technologies(properties)
+
+        tabblock_file = self.tabblock_file or find_tabblock_file(self.base_dir, state_abbr)
+        logging.info(f"Reading census blocks from {tabblock_file}")
+        blocks = read_tabblocks(tabblock_file, self.bbox)
+        served = blocks['GEOID20'].isin(list(properties)).sum()
+        logging.info(f"Joined {len(properties)} served blocks to {len(blocks)} census blocks ({served} matched) for state: {state_abbr}")
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        output_files = []
+        for block_format in self.formats:
+            output_file = get_block_output_file(self.output_dir, state_abbr, block_format)
+            temp_file = f"{output_file}.{os.getpid()}.tmp.{block_format}"
+            try:
+                if block_format == 'geojson':
+                    write_block_geojson(blocks, properties, temp_file, technologies)
+                else:
+                    write_block_gpkg(blocks, properties, temp_file, state_abbr, technologies)
+            except BaseException:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+                raise
+            os.replace(temp_file, output_file)
+            logging.info(f"Block-level {BLOCK_FORMATS[block_format]} file written to: {output_file}")
+            output_files.append(output_file)
+        return output_files
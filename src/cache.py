@@ -0,0 +1,152 @@
+# cache.py
+
+import os
+import json
+import hashlib
+import logging
+from readin import BDC_COLUMNS, BDC_DTYPES
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow is only needed for the cache
+    pa = None
+
+# Bump when the cached layout changes so stale entries are rebuilt
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_LIMIT_GB = 20
+
+CACHE_SUFFIX = '.arrow'
+META_SUFFIX = '.json'
+
+def get_cache_dir(base_dir):
+    return os.path.join(base_dir, 'USA_FCC-bdc', '.cache')
+
+def hash_file(file_path, block_size=1 << 20):
+    digest = hashlib.blake2b()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cache_schema():
+    # Categoricals are cached as their plain values; dictionaries differ from chunk to chunk
+    # and the Arrow file format cannot replace them mid-file
+    fields = []
+    for column in BDC_COLUMNS:
+        dtype = BDC_DTYPES[column]
+        if dtype == 'int64' or column == 'technology':
+            fields.append(pa.field(column, pa.int64()))
+        else:
+            fields.append(pa.field(column, pa.string()))
+    return pa.schema(fields)
+
+def open_bdc_cache(base_dir, rebuild=False, limit_gb=DEFAULT_CACHE_LIMIT_GB):
+    if pa is None:
+        logging.warning("pyarrow is not installed; reading BDC files without the cache")
+        return None
+    return BdcFileCache(get_cache_dir(base_dir), int(limit_gb * 1024 ** 3), rebuild)
+
+class BdcFileCache:
+    def __init__(self, cache_dir, max_bytes, rebuild=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.rebuild = rebuild
+
+    def paths(self, source_path):
+        name = os.path.basename(source_path)
+        return os.path.join(self.cache_dir, name + CACHE_SUFFIX), os.path.join(self.cache_dir, name + META_SUFFIX)
+
+    def source_info(self, source_path):
+        stat = os.stat(source_path)
+        return {"version": CACHE_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def is_valid(self, source_path):
+        cache_path, meta_path = self.paths(source_path)
+        if self.rebuild or not os.path.exists(cache_path) or not os.path.exists(meta_path):
+            return False
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        info = self.source_info(source_path)
+        if any(meta.get(key) != value for key, value in info.items()):
+            return False
+        # Size and mtime match; only then pay for hashing the source
+        return meta.get("hash") == hash_file(source_path)
+
+    def read_chunks(self, source_path, chunks):
+        # Yields the cached chunks of source_path if the cache is valid, otherwise yields from
+        # `chunks` (the normalized source reader) while writing them to the cache
+        if self.is_valid(source_path):
+            yield from self.read_cached(source_path)
+        else:
+            yield from self.write_through(source_path, chunks)
+
+    def read_cached(self, source_path):
+        cache_path, meta_path = self.paths(source_path)
+        logging.info(f"Reading cached BDC data for {os.path.basename(source_path)}")
+        os.utime(meta_path)  # Marks the entry as recently used for eviction
+        categoricals = {column: 'category' for column, dtype in BDC_DTYPES.items() if dtype == 'category'}
+        with pa.memory_map(cache_path, 'r') as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i).to_pandas().astype(categoricals)
+
+    def write_through(self, source_path, chunks):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cache_path, meta_path = self.paths(source_path)
+        info = self.source_info(source_path)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        schema = cache_schema()
+        categoricals = {column: 'object' for column, dtype in BDC_DTYPES.items() if dtype == 'category' and column != 'technology'}
+
+        try:
+            with pa.OSFile(temp_path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+                for chunk in chunks:
+                    plain = chunk.astype(categoricals).astype({'technology': 'int64'})
+                    writer.write_table(pa.Table.from_pandas(plain, schema=schema, preserve_index=False))
+                    yield chunk
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        info["hash"] = hash_file(source_path)
+        os.replace(temp_path, cache_path)
+        with open(meta_path, 'w') as f:
+            json.dump(info, f)
+        logging.info(f"Cached BDC data for {os.path.basename(source_path)} in {cache_path}")
+        self.evict(keep=cache_path)
+
+    def evict(self, keep=None):
+        # Workers may evict concurrently, so entries can disappear between listing and removal
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(CACHE_SUFFIX):
+                continue
+            meta_path = entry.path[:-len(CACHE_SUFFIX)] + META_SUFFIX
+            try:
+                size = entry.stat().st_size
+            except FileNotFoundError:
+                continue
+            try:
+                last_used = os.stat(meta_path).st_mtime
+            except FileNotFoundError:
+                last_used = 0
+            entries.append((last_used, size, entry.path, meta_path))
+
+        total = sum(size for _, size, _, _ in entries)
+        for last_used, size, cache_path, meta_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if cache_path == keep:
+                continue
+            logging.info(f"Evicting cached BDC data {os.path.basename(cache_path)}")
+            for path in (cache_path, meta_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
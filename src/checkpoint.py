@@ -0,0 +1,99 @@
+# checkpoint.py
+
+import os
+import json
+import shutil
+import logging
+import pandas as pd
+from aggregate import combine_tier_tables
+from writeout import find_latest_output
+from tables import find_latest_table
+
+# Bump when the checkpointed tier tables change layout so unfinished runs start over
+CHECKPOINT_VERSION = 1
+
+def get_checkpoint_dir(base_dir):
+    return os.path.join(base_dir, 'USA_FCC-bdc', '.checkpoints')
+
+def output_signature(base_dir):
+    # Name, size and mtime of the latest JSON and flat outputs the final write merges into
+    output_dir = os.path.join(base_dir, 'USA_FCC-bdc')
+    signature = []
+    for output_file in (find_latest_output(output_dir), find_latest_table(output_dir)):
+        if output_file:
+            stat = os.stat(output_file)
+            signature.append([os.path.basename(output_file), stat.st_size, stat.st_mtime_ns])
+    return signature
+
+class CheckpointStore:
+    # Keeps the tier table of every state a run has finished, each renamed into place before the manifest
+    # lists the state, so a run that dies part way can be resumed without re-reading finished states.
+    # The output is written once from the checkpoints at the end of the run, after which they are removed.
+    def __init__(self, base_dir, resume=False):
+        self.base_dir = base_dir
+        self.checkpoint_dir = get_checkpoint_dir(base_dir)
+        self.manifest_path = os.path.join(self.checkpoint_dir, 'manifest.json')
+        self.manifest = self.load_manifest() if resume else None
+        if self.manifest is None:
+            if os.path.exists(self.checkpoint_dir):
+                logging.info("Discarding checkpoints of an unfinished run; pass --resume to continue it instead")
+            self.clear()
+            # The previous output is recorded so a resumed run can tell whether the final write already happened
+            self.manifest = {"version": CHECKPOINT_VERSION, "previous_output": output_signature(base_dir), "states": []}
+            self.save_manifest()
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            logging.info("No checkpoints to resume from; starting a new run")
+            return None
+        if manifest.get("version") != CHECKPOINT_VERSION:
+            logging.info("Checkpoints are from another version; starting a new run")
+            return None
+        logging.info(f"Resuming run with finished states: {manifest['states']}")
+        return manifest
+
+    def save_manifest(self):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        temp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(temp_path, self.manifest_path)
+
+    def state_path(self, state_abbr):
+        return os.path.join(self.checkpoint_dir, f"{state_abbr}.pkl")
+
+    def is_done(self, state_abbr):
+        return state_abbr in self.manifest["states"] and os.path.exists(self.state_path(state_abbr))
+
+    def save(self, state_abbr, tier_table):
+        state_path = self.state_path(state_abbr)
+        temp_path = f"{state_path}.{os.getpid()}.tmp"
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        pd.to_pickle(tier_table, temp_path)
+        os.replace(temp_path, state_path)
+        if state_abbr not in self.manifest["states"]:
+            self.manifest["states"].append(state_abbr)
+        self.save_manifest()
+        logging.info(f"Checkpointed {len(tier_table)} speed tiers for state: {state_abbr}")
+
+    def mark_output_written(self):
+        # Recorded between the final write and clear(), so a run that dies in between is not merged twice
+        self.manifest["output_written"] = True
+        self.save_manifest()
+
+    def output_written(self):
+        # The run died after its final write but before removing the checkpoints, and merging them again
+        # would count them twice. Nothing else replaces the output during a run, so a changed output also
+        # means the write happened, even if some states never finished.
+        return self.manifest.get("output_written", False) or output_signature(self.base_dir) != self.manifest["previous_output"]
+
+    def combined_tier_table(self, states):
+        # States in the order given, so the output matches writing each state's tiers one after another
+        return combine_tier_tables(pd.read_pickle(self.state_path(state)) for state in states if self.is_done(state))
+
+    def clear(self):
+        if os.path.exists(self.checkpoint_dir):
+            shutil.rmtree(self.checkpoint_dir)
@@ -0,0 +1,151 @@
+# hexagons.py
+
+import os
+import logging
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from constant import TECH_ABBR_MAPPING
+from aggregate import group_reduce
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is only needed to write the rollup
+    pa = None
+
+# BDC locations are indexed at H3 resolution 8; coarser parents are derived from the same ids
+H3_BASE_RESOLUTION = 8
+
+# Bit layout of an H3 cell index: 4 resolution bits at 52-55, then one 3-bit digit per resolution 1-15
+H3_RESOLUTION_SHIFT = 52
+H3_RESOLUTION_MASK = np.int64(0xF) << np.int64(H3_RESOLUTION_SHIFT)
+
+# Hex digit value of each ASCII code point, -1 for anything that is not a hex digit
+H3_HEX_DIGITS = np.full(128, -1, dtype=np.int64)
+H3_HEX_DIGITS[48:58] = np.arange(10)
+H3_HEX_DIGITS[97:103] = np.arange(10, 16)
+H3_HEX_DIGITS[65:71] = np.arange(10, 16)
+
+TECH_CODES = np.array(sorted(TECH_ABBR_MAPPING), dtype=np.int64)
+
+def h3_to_int(h3_ids):
+    # Integer H3 indexes from their 15-character hex strings, decoded from the UCS-4 code points without
+    # a Python-level int(x, 16) per row. Missing or malformed ids become 0 (H3_NULL).
+    chars = np.asarray(h3_ids).astype(str).astype('U15').view(np.uint32).reshape(-1, 15)
+    digits = H3_HEX_DIGITS[np.minimum(chars, 127)]
+    valid = (digits >= 0).all(axis=1)
+    cells = np.zeros(len(chars), dtype=np.int64)
+    for column in range(15):
+        cells = (cells << np.int64(4)) | digits[:, column]
+    return np.where(valid, cells, 0)
+
+def encode_h3_ids(h3_ids):
+    # Each distinct id is decoded once; BDC files repeat every cell for all of its locations
+    codes, uniques = pd.factorize(h3_ids)
+    cells = np.append(h3_to_int(uniques), 0)
+    return cells[codes]  # code -1 (missing id) picks the trailing 0
+
+def h3_parent(cells, resolution):
+    # Parent cells at a coarser resolution: set the resolution field and mark every finer digit unused (7)
+    unused = np.int64(0)
+    for finer in range(resolution + 1, 16):
+        unused |= np.int64(7) << np.int64((15 - finer) * 3)
+    return (cells & ~H3_RESOLUTION_MASK) | (np.int64(resolution) << np.int64(H3_RESOLUTION_SHIFT)) | unused
+
+class H3Rollup:
+    # Rolls a state's BDC rows up per H3 cell as the chunks stream past. Partial tables keep one row per
+    # (cell, provider_id, technology) with location counts and max speeds, so per-cell distinct provider
+    # counts can still be taken after chunks and parent cells are merged.
+    stage = 'h3'
+
+    def __init__(self, base_dir, output_dir=None, parent_resolutions=(), fold_every=16):
+        if pa is None:
+            raise ImportError("The H3 rollup requires pyarrow: pip install pyarrow")
+        invalid = [resolution for resolution in parent_resolutions if not 0 <= resolution < H3_BASE_RESOLUTION]
+        if invalid:
+            raise ValueError(f"H3 parent resolutions must be between 0 and {H3_BASE_RESOLUTION - 1}: {invalid}")
+        self.output_dir = output_dir if output_dir is not None else os.path.join(base_dir, 'USA_FCC-bdc')
+        self.resolutions = [H3_BASE_RESOLUTION] + sorted(set(parent_resolutions), reverse=True)
+        self.fold_every = fold_every
+        self.partials = []
+
+    def rollup_chunk(self, chunk):
+        cells = encode_h3_ids(chunk['h3_res8_id'].to_numpy())
+        keep = cells != 0
+        return self.reduce_partials([(
+            cells[keep],
+            chunk['provider_id'].to_numpy(dtype=np.int64)[keep],
+            chunk['technology'].to_numpy(dtype=np.int64)[keep],
+            np.ones(keep.sum(), dtype=np.int64),
+            chunk['max_advertised_download_speed'].to_numpy(dtype=np.int64)[keep],
+            chunk['max_advertised_upload_speed'].to_numpy(dtype=np.int64)[keep]
+        )])
+
+    @staticmethod
+    def reduce_partials(partials):
+        cells, providers, techs, locations, downloads, uploads = (np.concatenate(columns) for columns in zip(*partials))
+        keys, sums, maxes = group_reduce([cells, providers, techs], [locations], [downloads, uploads])
+        return tuple(keys + sums + maxes)
+
+    def check(self, state_abbr):
+        # Needs nothing beyond the BDC files themselves
+        pass
+
+    def collect(self, chunks):
+        self.partials = []
+        for chunk in chunks:
+            self.partials.append(self.rollup_chunk(chunk))
+            if len(self.partials) >= self.fold_every:
+                self.partials = [self.reduce_partials(self.partials)]
+            yield chunk
+
+    def cell_table(self, cells, providers, techs, locations, downloads, uploads, resolution):
+        if resolution != H3_BASE_RESOLUTION:
+            cells = h3_parent(cells, resolution)
+            (cells, providers, techs), (locations,), (downloads, uploads) = group_reduce(
+                [cells, providers, techs], [locations], [downloads, uploads])
+
+        # Distinct providers per cell: one row per (cell, provider) after reducing away technology
+        (provider_cells, _), _, _ = group_reduce([cells, providers])
+        cell_ids, provider_counts = np.unique(provider_cells, return_counts=True)
+
+        (_,), (cell_locations,), (cell_downloads, cell_uploads) = group_reduce([cells], [locations], [downloads, uploads])
+        columns = {
+            "h3_cell": pa.array(cell_ids.astype(np.uint64)),
+            "resolution": pa.array(np.full(len(cell_ids), resolution, dtype=np.int8)),
+            "providers": pa.array(provider_counts.astype(np.int32)),
+            "locations": pa.array(cell_locations),
+            "max_download_speed": pa.array(cell_downloads),
+            "max_upload_speed": pa.array(cell_uploads)
+        }
+
+        # Technology mix: locations per technology, one int column per code in TECH_ABBR_MAPPING
+        positions = np.searchsorted(cell_ids, cells)
+        tech_index = np.searchsorted(TECH_CODES, techs).clip(0, len(TECH_CODES) - 1)
+        known = TECH_CODES[tech_index] == techs
+        mix = np.zeros((len(cell_ids), len(TECH_CODES)), dtype=np.int64)
+        np.add.at(mix, (positions[known], tech_index[known]), locations[known])
+        for i, tech in enumerate(TECH_CODES.tolist()):
+            columns[TECH_ABBR_MAPPING[tech]] = pa.array(mix[:, i])
+        return pa.table(columns)
+
+    def write(self, state_abbr):
+        rollup = self.reduce_partials(self.partials) if self.partials else tuple(np.array([], dtype=np.int64) for _ in range(6))
+        self.partials = []
+        tables = [self.cell_table(*rollup, resolution) for resolution in self.resolutions]
+        for resolution, table in zip(self.resolutions, tables):
+            logging.info(f"Rolled up {state_abbr} into {table.num_rows} H3 cells at resolution {resolution}")
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        output_file = os.path.join(self.output_dir, f"fccbdchex_{state_abbr}_{datetime.now().strftime('%m%d%Y')}.parquet")
+        temp_file = f"{output_file}.{os.getpid()}.tmp"
+        try:
+            pq.write_table(pa.concat_tables(tables), temp_file, compression='zstd')
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+        os.replace(temp_file, output_file)
+        logging.info(f"H3 rollup written to: {output_file}")
+        return output_file
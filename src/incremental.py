@@ -0,0 +1,163 @@
+# incremental.py
+
+import os
+import json
+import logging
+import pandas as pd
+from constant import STATES_AND_TERRITORIES
+from resources import STATE_NAME_BY_FIPS, get_state_info
+from readin import get_bdc_files, iter_file_chunks, prefetch_chunks, DEFAULT_CHUNKSIZE
+from aggregate import combine_tier_tables
+from spill import aggregate_with_spill
+from cache import hash_file
+
+# Bump when the stored tier tables change layout so every file is re-aggregated
+MANIFEST_VERSION = 1
+
+STATE_ORDER = {abbr: i for i, (fips, abbr, name) in enumerate(STATES_AND_TERRITORIES)}
+
+def get_incremental_dir(base_dir):
+    return os.path.join(base_dir, 'USA_FCC-bdc', '.incremental')
+
+SUBTREE_COLUMNS = ['provider', 'state', 'technology']
+
+def tier_subtrees(tier_table):
+    # Distinct provider -> state -> technology subtrees a tier table contributes to
+    subtrees = tier_table[SUBTREE_COLUMNS].drop_duplicates()
+    return [list(subtree) for subtree in zip(*(subtrees[column].tolist() for column in subtrees.columns))]
+
+def get_state_key(state_abbr):
+    # Same "Name, FIPS" key as CountyIndex.state_keys
+    fips, abbr, name = get_state_info(state_abbr)
+    return f"{STATE_NAME_BY_FIPS[fips]}, {fips}"
+
+class IncrementalStore:
+    # Keeps one aggregated tier table per BDC source file plus a manifest of each file's hash and
+    # the subtrees it contributed, so a run only re-aggregates files whose contents changed. The subtrees
+    # of changed and removed files are collected in `replaced`, and whole states new to the store in
+    # `replaced_states`, so only those parts of the previous output are rebuilt.
+    def __init__(self, base_dir):
+        self.store_dir = get_incremental_dir(base_dir)
+        self.manifest_path = os.path.join(self.store_dir, 'manifest.json')
+        self.files = self.load_manifest()
+        self.replaced = set()
+        self.replaced_states = set()
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {}
+        if manifest.get("version") != MANIFEST_VERSION:
+            logging.info("Incremental manifest is from another version; re-aggregating all files")
+            return {}
+        return manifest["files"]
+
+    def save_manifest(self):
+        os.makedirs(self.store_dir, exist_ok=True)
+        temp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({"version": MANIFEST_VERSION, "files": self.files}, f, indent=2)
+        os.replace(temp_path, self.manifest_path)
+
+    def tier_path(self, key):
+        return os.path.join(self.store_dir, key.replace('/', '__') + '.pkl')
+
+    def is_current(self, key, file_path):
+        entry = self.files.get(key)
+        if entry is None or not os.path.exists(self.tier_path(key)):
+            return False
+        stat = os.stat(file_path)
+        if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return True
+        # Re-downloaded files get a new mtime; the hash decides whether the contents changed
+        if entry["size"] == stat.st_size and entry["hash"] == hash_file(file_path):
+            entry["mtime_ns"] = stat.st_mtime_ns
+            return True
+        return False
+
+    def update_state(self, base_dir, state_abbr, county_mapping, chunksize=DEFAULT_CHUNKSIZE, cache=None, metrics=None, prefetch=0, manifest=None, spill_threshold=None):
+        bdc_dir, bdc_files = get_bdc_files(base_dir, state_abbr, manifest)
+        state_dir = os.path.basename(bdc_dir)
+        os.makedirs(self.store_dir, exist_ok=True)
+        # A state the store has not seen yet may still be in the previous output from a normal run, so all of it is replaced
+        tracked = any(entry["state"] == state_abbr for entry in self.files.values())
+
+        replaced = set()
+        current = set()
+        changed = []
+        for bdc_file in sorted(bdc_files):
+            key = f"{state_dir}/{bdc_file}"
+            current.add(key)
+            if self.is_current(key, os.path.join(bdc_dir, bdc_file)):
+                logging.info(f"Unchanged since last run: {key}")
+            else:
+                changed.append(bdc_file)
+
+        file_chunks = (iter_file_chunks(os.path.join(bdc_dir, bdc_file), chunksize, cache) for bdc_file in changed)
+        if prefetch > 0:
+            file_chunks = prefetch_chunks(file_chunks, prefetch)
+        for bdc_file, chunks in zip(changed, file_chunks):
+            key = f"{state_dir}/{bdc_file}"
+            file_path = os.path.join(bdc_dir, bdc_file)
+            logging.info(f"Re-aggregating changed BDC file: {key}")
+            if metrics is not None:
+                chunks = metrics.timed_chunks(chunks, state_abbr, bdc_file)
+            tier_table = aggregate_with_spill(chunks, county_mapping, spill_threshold)
+            tier_path = self.tier_path(key)
+            temp_path = f"{tier_path}.{os.getpid()}.tmp"
+            pd.to_pickle(tier_table, temp_path)
+            os.replace(temp_path, tier_path)
+
+            stat = os.stat(file_path)
+            subtrees = tier_subtrees(tier_table)
+            previous = self.files.get(key)
+            if previous is not None:
+                replaced.update(map(tuple, previous["subtrees"]))
+            replaced.update(map(tuple, subtrees))
+            if not tracked:
+                self.replaced_states.add(get_state_key(state_abbr))
+            # Recorded per file, so the output matches the store even if a later file of the state fails
+            self.replaced.update(replaced)
+            self.files[key] = {
+                "state": state_abbr,
+                "hash": hash_file(file_path),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "subtrees": subtrees
+            }
+
+        # Files that disappeared from the state directory no longer contribute
+        for key in [key for key, entry in self.files.items() if entry["state"] == state_abbr and key not in current]:
+            logging.info(f"Removing BDC file no longer present: {key}")
+            replaced.update(map(tuple, self.files.pop(key)["subtrees"]))
+            if os.path.exists(self.tier_path(key)):
+                os.remove(self.tier_path(key))
+        self.replaced.update(replaced)
+
+        self.save_manifest()
+        logging.info(f"Replaced {len(replaced)} provider/state/technology subtrees for state: {state_abbr}")
+        return replaced
+
+    def sorted_keys(self, keys):
+        # States in STATES_AND_TERRITORIES order, files by name, so the output order is stable between runs
+        return sorted(keys, key=lambda key: (STATE_ORDER.get(self.files[key]["state"], len(STATE_ORDER)), key))
+
+    def combined_tier_table(self):
+        return combine_tier_tables(pd.read_pickle(self.tier_path(key)) for key in self.sorted_keys(self.files))
+
+    def replaced_rows(self, tier_table):
+        subtrees = pd.MultiIndex.from_arrays([tier_table[column].astype(object) for column in SUBTREE_COLUMNS])
+        return subtrees.isin(list(self.replaced)) | tier_table['state'].isin(list(self.replaced_states)).to_numpy()
+
+    def merge_into(self, previous):
+        # The previous output with the replaced subtrees and states swapped for the store's current tiers;
+        # only the stored tables of files contributing to them are read
+        keys = [key for key, entry in self.files.items()
+                if get_state_key(entry["state"]) in self.replaced_states or any(tuple(subtree) in self.replaced for subtree in entry["subtrees"])]
+        current = combine_tier_tables(pd.read_pickle(self.tier_path(key)) for key in self.sorted_keys(keys))
+        kept = previous[~self.replaced_rows(previous)] if len(previous) else previous
+        changed = current[self.replaced_rows(current)] if len(current) else current
+        logging.info(f"Replacing {len(previous) - len(kept)} of {len(previous)} previous speed tiers with {len(changed)} from the incremental store")
+        return combine_tier_tables([kept, changed])
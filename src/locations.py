@@ -0,0 +1,153 @@
+# locations.py
+
+import os
+import logging
+import numpy as np
+from datetime import datetime
+from constant import TECH_ABBR_MAPPING
+from resources import CountyIndex, COUNTY_DIGIT_WEIGHTS
+from aggregate import group_reduce
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is only needed to write the location summaries
+    pa = None
+
+def county_positions(block_geoids, counties):
+    # Dense CountyIndex positions of each record's county, -1 where the GEOID is malformed or the county unknown
+    digits = block_geoids.astype(str).astype('U5').view(np.uint32).reshape(-1, 5).astype(np.int32) - ord('0')
+    valid = ((digits >= 0) & (digits <= 9)).all(axis=1)
+    return np.where(valid, counties.lookup[np.where(valid, digits @ COUNTY_DIGIT_WEIGHTS, 0)], -1)
+
+def dictionary_array(codes, keys):
+    return pa.DictionaryArray.from_arrays(pa.array(codes, type=pa.int32()), pa.array(keys, type=pa.string()))
+
+class LocationSummary:
+    # Unique-location counts per county, technology and provider, and the best available speed of every
+    # location. BDC files list a location once per provider and technology offering, so the tier counts
+    # count offerings. Here each chunk is reduced to sorted, distinct (county, location_id, technology,
+    # provider_id) rows in fixed-width NumPy arrays (~30 bytes a row) with the best speeds of each
+    # offering; distinct counts at every level come from runs in that sort order, with no Python sets.
+    stage = 'locations'
+
+    def __init__(self, base_dir, county_mapping, output_dir=None, holder_mapping=None, fold_every=16):
+        if pa is None:
+            raise ImportError("Location summaries require pyarrow: pip install pyarrow")
+        self.counties = county_mapping if isinstance(county_mapping, CountyIndex) else CountyIndex(county_mapping)
+        self.output_dir = output_dir if output_dir is not None else os.path.join(base_dir, 'USA_FCC-bdc')
+        self.holder_mapping = holder_mapping or {}
+        self.fold_every = fold_every
+        self.partials = []
+
+    def offerings_chunk(self, chunk):
+        counties = county_positions(chunk['block_geoid'].to_numpy(), self.counties)
+        keep = counties >= 0
+        return self.reduce_partials([(
+            counties[keep].astype(np.int32),
+            chunk['location_id'].to_numpy(dtype=np.int64)[keep],
+            chunk['technology'].to_numpy(dtype=np.int16)[keep],
+            chunk['provider_id'].to_numpy(dtype=np.int64)[keep],
+            chunk['max_advertised_download_speed'].to_numpy(dtype=np.int32)[keep],
+            chunk['max_advertised_upload_speed'].to_numpy(dtype=np.int32)[keep],
+            chunk['low_latency'].to_numpy(dtype=np.int8)[keep]
+        )])
+
+    @staticmethod
+    def reduce_partials(partials):
+        counties, locations, techs, providers, downloads, uploads, low_latency = (np.concatenate(columns) for columns in zip(*partials))
+        keys, _, maxes = group_reduce([counties, locations, techs, providers], [], [downloads, uploads, low_latency])
+        return tuple(keys + maxes)
+
+    def check(self, state_abbr):
+        # Needs nothing beyond the BDC files themselves
+        pass
+
+    def collect(self, chunks):
+        self.partials = []
+        for chunk in chunks:
+            self.partials.append(self.offerings_chunk(chunk))
+            if len(self.partials) >= self.fold_every:
+                self.partials = [self.reduce_partials(self.partials)]
+            yield chunk
+
+    def location_table(self, offerings):
+        # One row per location: best download/upload speed and low latency across all of its offerings
+        counties, locations, techs, providers, downloads, uploads, low_latency = offerings
+        new_location = np.ones(len(locations), dtype=bool)
+        new_location[1:] = (locations[1:] != locations[:-1]) | (counties[1:] != counties[:-1])
+        starts = np.flatnonzero(new_location)
+        location_index = np.cumsum(new_location) - 1
+
+        # Technologies are sorted within a location, providers are not; count those via distinct pairs
+        new_tech = new_location.copy()
+        new_tech[1:] |= techs[1:] != techs[:-1]
+        (provider_locations, _), _, _ = group_reduce([location_index, providers])
+        return pa.table({
+            "location_id": pa.array(locations[starts]),
+            "state": dictionary_array(counties[starts], self.counties.state_keys),
+            "county": dictionary_array(counties[starts], self.counties.county_keys),
+            "max_download_speed": pa.array(np.maximum.reduceat(downloads, starts) if len(starts) else downloads),
+            "max_upload_speed": pa.array(np.maximum.reduceat(uploads, starts) if len(starts) else uploads),
+            "low_latency": pa.array(np.maximum.reduceat(low_latency, starts) if len(starts) else low_latency),
+            "providers": pa.array(np.bincount(provider_locations, minlength=len(starts)).astype(np.int32)),
+            "technologies": pa.array(np.bincount(location_index[new_tech], minlength=len(starts)).astype(np.int16)),
+            "offerings": pa.array(np.diff(np.append(starts, len(locations))).astype(np.int32))
+        }), new_location, new_tech
+
+    def count_table(self, offerings, new_location, new_tech):
+        # Unique locations per county, per county and technology, and per county, technology and provider.
+        # Distinct counts do not add up across providers or technologies, so every level is counted on its
+        # own; a null technology or provider_id marks the rows covering all of them.
+        counties, locations, techs, providers = offerings[:4]
+        levels = [
+            ([counties[new_location]], None, None),
+            ([counties[new_tech], techs[new_tech]], True, None),
+            ([counties, techs, providers], True, True)
+        ]
+        columns = {"county_code": [], "technology": [], "provider_id": [], "locations": []}
+        for keys, by_tech, by_provider in levels:
+            keys, (counts,), _ = group_reduce(keys, [np.ones(len(keys[0]), dtype=np.int64)])
+            columns["county_code"].append(keys[0])
+            columns["technology"].append(keys[1] if by_tech else np.full(len(counts), -1, dtype=np.int16))
+            columns["provider_id"].append(keys[2] if by_provider else np.full(len(counts), -1, dtype=np.int64))
+            columns["locations"].append(counts)
+        county_codes, tech_codes, provider_ids, counts = (np.concatenate(values) for values in columns.values())
+
+        tech_keys = {tech: f"{TECH_ABBR_MAPPING.get(tech, 'Unknown')}, {tech}" for tech in np.unique(tech_codes).tolist()}
+        tech_keys[-1] = None
+        return pa.table({
+            "state": dictionary_array(county_codes, self.counties.state_keys),
+            "county": dictionary_array(county_codes, self.counties.county_keys),
+            "technology": pa.array([tech_keys[tech] for tech in tech_codes.tolist()], type=pa.string()).dictionary_encode(),
+            "provider_id": pa.array(provider_ids, mask=provider_ids == -1),
+            "holding_company": pa.array([self.holder_mapping.get(provider_id) for provider_id in provider_ids.tolist()], type=pa.string()),
+            "locations": pa.array(counts)
+        })
+
+    def write(self, state_abbr):
+        offerings = self.reduce_partials(self.partials) if self.partials else self.reduce_partials([(
+            np.array([], dtype=np.int32), np.array([], dtype=np.int64), np.array([], dtype=np.int16),
+            np.array([], dtype=np.int64), np.array([], dtype=np.int32), np.array([], dtype=np.int32),
+            np.array([], dtype=np.int8))])
+        self.partials = []
+        location_table, new_location, new_tech = self.location_table(offerings)
+        count_table = self.count_table(offerings, new_location, new_tech)
+        logging.info(f"Found {location_table.num_rows} unique locations in {len(offerings[0])} provider/technology offerings for state: {state_abbr}")
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        date = datetime.now().strftime('%m%d%Y')
+        output_files = []
+        for prefix, table in (("fccbdcuniq", count_table), ("fccbdcloc", location_table)):
+            output_file = os.path.join(self.output_dir, f"{prefix}_{state_abbr}_{date}.parquet")
+            temp_file = f"{output_file}.{os.getpid()}.tmp"
+            try:
+                pq.write_table(table, temp_file, compression='zstd')
+            except BaseException:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+                raise
+            os.replace(temp_file, output_file)
+            output_files.append(output_file)
+        logging.info(f"Unique-location counts and best speeds per location written to: {output_files}")
+        return output_files
@@ -2,10 +2,22 @@ import os
 import argparse
 import logging
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from constant import STATES_AND_TERRITORIES
-from prepdata import prepare_data, load_holder_mapping
-from readin import read_data
-from writeout import write_consolidated_json
+from prepdata import prepare_data
+from resources import load_resources
+from readin import iter_bdc_chunks, check_required_files, DEFAULT_CHUNKSIZE
+from spill import aggregate_with_spill, SpillThreshold
+from cache import open_bdc_cache, DEFAULT_CACHE_LIMIT_GB
+from incremental import IncrementalStore
+from checkpoint import CheckpointStore
+from manifest import FileManifest
+from writeout import write_consolidated_tiers, write_providers, iter_merged_providers, check_compression, OUTPUT_COMPRESSION
+from tables import write_consolidated_table, write_tier_table, get_table_output_file, find_latest_previous_output, read_existing_tiers, TABLE_FORMATS
+from metrics import RunMetrics, STAGES
+from blocks import BlockWriter, BLOCK_FORMATS
+from hexagons import H3Rollup, H3_BASE_RESOLUTION
+from locations import LocationSummary
 
 def setup_logging(log_file, base_dir):
     if log_file is not None:
@@ -20,35 +32,243 @@ def parse_arguments():
     parser.add_argument('-s', '--state', type=str, nargs='*', default=[state[1] for state in STATES_AND_TERRITORIES], help='State abbreviation(s) to process')
     parser.add_argument('--log-file', type=str, nargs='?', const='fccbdcsum_log.log', help='Log file path')
     parser.add_argument('-o', '--output-dir', type=str, help='Output directory for data files')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of states to read and aggregate in parallel')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNKSIZE, help='Rows to read from a BDC file at a time')
+    parser.add_argument('--prefetch', type=int, default=0, metavar='FILES', help='Decompress and parse up to this many BDC files of a state on background threads while aggregating (default: off)')
+    parser.add_argument('--no-cache', action='store_true', help='Read BDC files and resources directly without the parsed-file and resource caches')
+    parser.add_argument('--rebuild-cache', action='store_true', help='Re-parse BDC files and replace their cache entries')
+    parser.add_argument('--cache-limit-gb', type=float, default=DEFAULT_CACHE_LIMIT_GB, help='Maximum size of the parsed-file cache in GB')
+    parser.add_argument('--spill-threshold', type=float, metavar='MB', help='Spill sorted partial aggregates to disk once RSS passes this many MB and merge them at the end of each state; not a memory cap')
+    parser.add_argument('--incremental', action='store_true', help='Only re-aggregate BDC files that changed since the last incremental run')
+    parser.add_argument('--dry-run', action='store_true', help='Report the BDC files, bytes and estimated rows each state would read, without reading them')
+    parser.add_argument('--resume', action='store_true', help='Continue an interrupted run from its per-state checkpoints instead of starting over')
+    parser.add_argument('--format', choices=['json'] + list(TABLE_FORMATS), default='json', help='Write the nested JSON, or the same speed tiers as a flat, dictionary-encoded Parquet or Arrow table')
+    parser.add_argument('--compact', action='store_true', help='Write the JSON without indentation')
+    parser.add_argument('--compress', choices=[name for name in OUTPUT_COMPRESSION if name], help='Compress the JSON output')
+    parser.add_argument('--blocks', nargs='*', choices=list(BLOCK_FORMATS), help='Also write block-level features joined to tl_XX_tabblock20, per state (default: gpkg and geojson)')
+    parser.add_argument('--bbox', type=float, nargs=4, metavar=('MINX', 'MINY', 'MAXX', 'MAXY'), help='Only read census blocks within this bounding box for --blocks')
+    parser.add_argument('--h3', type=int, nargs='*', choices=range(H3_BASE_RESOLUTION), metavar='RESOLUTION', help=f'Also write a per-state H3 rollup at resolution {H3_BASE_RESOLUTION}, plus any coarser parent resolutions given')
+    parser.add_argument('--locations', action='store_true', help='Also write unique-location counts per county, technology and provider, and the best available speed per location, per state')
+    parser.add_argument('--metrics-out', type=str, help='Write per-stage, per-state run metrics to this .json or .csv file')
+    parser.add_argument('--profile-stage', choices=STAGES, help='Run this stage under cProfile and save its stats next to the metrics')
     parser.add_argument('-v', '--version', action='version', version='%(prog)s 1.0', help='Print version and exit')
-    return parser.parse_args()
+    args = parser.parse_args()
+    try:
+        check_compression(args.compress)
+    except ImportError as e:
+        parser.error(str(e))
+    return args
+
+def process_state(base_dir, state, county_mapping, chunksize=DEFAULT_CHUNKSIZE, cache=None, metrics=None, state_writers=(), prefetch=0, manifest=None, spill_threshold=None):
+    # Streams the state's BDC files through the aggregation; returns a compact tier table rather than a nested provider map
+    metrics = metrics if metrics is not None else RunMetrics()
+    prepare_data(base_dir, state, manifest)
+    with metrics.stage('check_files', state):
+        check_required_files(base_dir, state, manifest)
+    # Per-state outputs are optional, so one that cannot be written is skipped rather than losing the state's tiers
+    active_writers = []
+    for state_writer in state_writers:
+        try:
+            state_writer.check(state)
+        except Exception as e:
+            logging.error(f"Skipping {state_writer.stage} output for state {state}: {e}")
+            continue
+        active_writers.append(state_writer)
+    with metrics.stage('aggregate', state) as stage:
+        chunks = iter_bdc_chunks(base_dir, state, chunksize, cache, metrics, prefetch, manifest)
+        # Per-state outputs (blocks, H3 rollup, location summaries) collect from the same chunks, so the files are only read once
+        for state_writer in active_writers:
+            chunks = state_writer.collect(chunks)
+        tier_table = aggregate_with_spill(chunks, county_mapping, spill_threshold)
+        stage.rows = metrics.rows(state, 'read')
+    for state_writer in active_writers:
+        try:
+            with metrics.stage(state_writer.stage, state, rows=stage.rows):
+                state_writer.write(state)
+        except Exception as e:
+            logging.error(f"Failed to write {state_writer.stage} output for state {state}: {e}")
+    logging.info(f'Finished processing BDC files for state: {state}')
+    return tier_table
+
+def process_state_measured(base_dir, state, county_mapping, chunksize, cache, profile_stage, profile_dir, state_writers=(), prefetch=0, manifest=None, spill_threshold=None):
+    # Worker entry point: metrics and profiles are collected in the worker and the records returned with the tier table
+    metrics = RunMetrics(profile_stage, profile_dir)
+    tier_table = process_state(base_dir, state, county_mapping, chunksize, cache, metrics, state_writers, prefetch, manifest, spill_threshold)
+    metrics.write_profiles()
+    return tier_table, metrics.stages
+
+def write_tiers(tier_table, base_dir, output_dir, indent, compression, metrics, state=None, output_format='json'):
+    with metrics.stage('write', state, rows=len(tier_table)):
+        if output_format == 'json':
+            write_consolidated_tiers(tier_table, base_dir, output_dir, indent, compression)
+        else:
+            write_consolidated_table(tier_table, base_dir, output_dir, output_format)
+
+def write_checkpointed(checkpoints, states_to_process, base_dir, output_dir, indent, compression, metrics, output_format='json'):
+    # One write of every finished state in the requested order, which gives the same output as writing the
+    # states one by one; the checkpoints are only removed once the output is in place
+    finished = [state for state in states_to_process if checkpoints.is_done(state)]
+    if not finished:
+        logging.warning("No states finished processing; nothing to write")
+        checkpoints.clear()
+        return
+    write_tiers(checkpoints.combined_tier_table(finished), base_dir, output_dir, indent, compression, metrics, output_format=output_format)
+    checkpoints.mark_output_written()
+    checkpoints.clear()
+    logging.info('Processing completed.')
+
+def process_states_sequential(base_dir, output_dir, states_to_process, county_mapping, chunksize, cache=None, indent=2, compression=None, metrics=None, state_writers=(), prefetch=0, output_format='json', checkpoints=None, manifest=None, spill_threshold=None):
+    metrics = metrics if metrics is not None else RunMetrics()
+    checkpoints = checkpoints if checkpoints is not None else CheckpointStore(base_dir)
+    for state in states_to_process:
+        if checkpoints.is_done(state):
+            logging.info(f'Skipping state already checkpointed: {state}')
+            continue
+        logging.info(f'Processing state: {state}')
+        try:
+            tier_table = process_state(base_dir, state, county_mapping, chunksize, cache, metrics, state_writers, prefetch, manifest, spill_threshold)
+            logging.debug(f"BDC speed tiers for {state}: {tier_table}")
+            checkpoints.save(state, tier_table)
+        except FileExistsError as e:
+            logging.warning(f"Skipping state {state}: {e}")
+        except Exception as e:
+            logging.error(f"Error processing state {state}: {e}", exc_info=True)
+
+    write_checkpointed(checkpoints, states_to_process, base_dir, output_dir, indent, compression, metrics, output_format)
+
+def process_states_parallel(base_dir, output_dir, states_to_process, county_mapping, workers, chunksize, cache=None, indent=2, compression=None, metrics=None, state_writers=(), prefetch=0, output_format='json', checkpoints=None, manifest=None, spill_threshold=None):
+    metrics = metrics if metrics is not None else RunMetrics()
+    checkpoints = checkpoints if checkpoints is not None else CheckpointStore(base_dir)
+    # Each worker process spills at an equal share of the threshold
+    spill_threshold = spill_threshold.share(workers) if spill_threshold is not None else None
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_state_measured, base_dir, state, county_mapping, chunksize, cache, metrics.profile_stage, metrics.profile_dir, state_writers, prefetch, manifest, spill_threshold): state
+                   for state in states_to_process if not checkpoints.is_done(state)}
+        # States are checkpointed as they finish; the reduce reads them back in the requested order so the output matches a sequential run
+        for future in as_completed(futures):
+            state = futures[future]
+            try:
+                tier_table, stages = future.result()
+                metrics.extend(stages)
+                logging.info(f'Collected {len(tier_table)} speed tiers for state: {state}')
+                checkpoints.save(state, tier_table)
+            except FileExistsError as e:
+                logging.warning(f"Skipping state {state}: {e}")
+            except Exception as e:
+                logging.error(f"Error processing state {state}: {e}", exc_info=True)
+
+    write_checkpointed(checkpoints, states_to_process, base_dir, output_dir, indent, compression, metrics, output_format)
+
+def process_states_incremental(base_dir, output_dir, states_to_process, county_mapping, chunksize, cache=None, indent=2, compression=None, metrics=None, prefetch=0, output_format='json', manifest=None, spill_threshold=None):
+    # Re-running a state replaces its subtrees in the previous output instead of adding to them; without a
+    # previous output the store, which holds every state run incrementally, is written whole
+    metrics = metrics if metrics is not None else RunMetrics()
+    store = IncrementalStore(base_dir)
+    for state in states_to_process:
+        logging.info(f'Processing state: {state}')
+        try:
+            prepare_data(base_dir, state, manifest)
+            with metrics.stage('check_files', state):
+                check_required_files(base_dir, state, manifest)
+            with metrics.stage('aggregate', state) as stage:
+                store.update_state(base_dir, state, county_mapping, chunksize, cache, metrics, prefetch, manifest, spill_threshold)
+                stage.rows = metrics.rows(state, 'read')
+        except FileExistsError as e:
+            logging.warning(f"Skipping state {state}: {e}")
+        except Exception as e:
+            logging.error(f"Error processing state {state}: {e}", exc_info=True)
+
+    if find_latest_previous_output(os.path.join(base_dir, 'USA_FCC-bdc')):
+        tier_table = store.merge_into(read_existing_tiers(base_dir))
+    else:
+        tier_table = store.combined_tier_table()
+    with metrics.stage('write', rows=len(tier_table)):
+        if output_format == 'json':
+            write_providers(iter_merged_providers(tier_table, {}), base_dir, output_dir, indent, compression)
+        else:
+            write_tier_table(tier_table, get_table_output_file(output_dir or os.path.join(base_dir, 'USA_FCC-bdc'), output_format), output_format)
+    logging.info('Processing completed.')
+
+def report_work_volume(manifest, states_to_process):
+    # --dry-run: what a run would read, from the file manifest alone; rows are estimated from each file's first MiB
+    print(f"{'state':<6}{'files':>6}{'on disk':>14}{'uncompressed':>16}{'est. rows':>14}  technologies")
+    totals = {"files": 0, "bytes": 0, "uncompressed_bytes": 0, "rows": 0}
+    for state in states_to_process:
+        try:
+            volume = manifest.work_volume(state)
+        except ValueError as e:
+            logging.warning(f"Skipping state {state}: {e}")
+            continue
+        for key in totals:
+            totals[key] += volume[key]
+        print(f"{state:<6}{volume['files']:>6}{volume['bytes'] / 1024 ** 2:>11,.1f} MB{volume['uncompressed_bytes'] / 1024 ** 2:>13,.1f} MB"
+              f"{volume['rows']:>14,}  {', '.join(volume['technologies']) or 'no BDC files'}")
+    print(f"{'total':<6}{totals['files']:>6}{totals['bytes'] / 1024 ** 2:>11,.1f} MB{totals['uncompressed_bytes'] / 1024 ** 2:>13,.1f} MB{totals['rows']:>14,}")
 
 def main():
     args = parse_arguments()
     setup_logging(args.log_file, args.base_dir)
     
+    logging.info(f'Starting processing for states: {args.state} in base directory: {args.base_dir}')
+    
+    profile_dir = os.path.dirname(os.path.abspath(args.metrics_out)) if args.metrics_out else args.base_dir
+    metrics = RunMetrics(args.profile_stage, profile_dir)
+    try:
+        run(args, metrics)
+    finally:
+        metrics.write_profiles()
+        if args.metrics_out:
+            metrics.write(args.metrics_out)
+
+def run(args, metrics):
     base_dir = args.base_dir
     output_dir = args.output_dir
     states_to_process = args.state
 
-    logging.info(f'Starting processing for states: {states_to_process} in base directory: {base_dir}')
-    
-    holder_mapping = load_holder_mapping(base_dir)
+    with metrics.stage('discover'):
+        manifest = FileManifest.discover(base_dir, use_cache=not args.no_cache)
+    if args.dry_run:
+        report_work_volume(manifest, states_to_process)
+        return
+
+    with metrics.stage('resources'):
+        resources = load_resources(base_dir, use_cache=not args.no_cache, holder_mapping_file=manifest.holder_mapping_file)
+    holder_mapping = resources.holder_mapping
     logging.debug(f"Holder mapping loaded: {holder_mapping}")
 
-    for state in states_to_process:
-        logging.info(f'Processing state: {state}')
-        try:
-            prepare_data(base_dir, state)
-            bdc_data = read_data(base_dir, state)
-            logging.debug(f"BDC data for {state}: {bdc_data}")
-            logging.info(f'Finished processing BDC files for state: {state}')
-            write_consolidated_json(bdc_data, base_dir, output_dir)
-            logging.info('Processing completed.')
-        except FileExistsError as e:
-            logging.warning(f"Skipping state {state}: {e}")
-        except Exception as e:
-            logging.error(f"Error processing state {state}: {e}", exc_info=True)   
+    county_mapping = resources.counties
+    cache = None if args.no_cache else open_bdc_cache(base_dir, args.rebuild_cache, args.cache_limit_gb)
+    indent = None if args.compact else 2
+    spill_threshold = SpillThreshold(args.spill_threshold, os.path.join(base_dir, 'USA_FCC-bdc', '.spill')) if args.spill_threshold else None
+    state_writers = []
+    if args.blocks is not None:
+        state_writers.append(BlockWriter(base_dir, output_dir, holder_mapping, args.blocks or tuple(BLOCK_FORMATS), args.bbox))
+    if args.h3 is not None:
+        state_writers.append(H3Rollup(base_dir, output_dir, args.h3))
+    if args.locations:
+        state_writers.append(LocationSummary(base_dir, county_mapping, output_dir, holder_mapping))
+
+    if args.incremental:
+        if state_writers:
+            logging.warning("--blocks, --h3 and --locations are ignored with --incremental, which does not re-read unchanged BDC files")
+        if args.resume:
+            logging.warning("--resume is ignored with --incremental, whose store already keeps every finished BDC file")
+        if args.workers > 1:
+            logging.warning("--workers is ignored with --incremental, which re-aggregates changed BDC files one at a time")
+        process_states_incremental(base_dir, output_dir, states_to_process, county_mapping, args.chunk_size, cache, indent, args.compress, metrics, args.prefetch, args.format, manifest, spill_threshold)
+        return
+
+    checkpoints = CheckpointStore(base_dir, args.resume)
+    if args.resume and checkpoints.output_written():
+        logging.info("The interrupted run had already written its output; removing its checkpoints")
+        checkpoints.clear()
+        return
+
+    if args.workers > 1:
+        process_states_parallel(base_dir, output_dir, states_to_process, county_mapping, args.workers, args.chunk_size, cache, indent, args.compress, metrics, state_writers, args.prefetch, args.format, checkpoints, manifest, spill_threshold)
+        return
+
+    process_states_sequential(base_dir, output_dir, states_to_process, county_mapping, args.chunk_size, cache, indent, args.compress, metrics, state_writers, args.prefetch, args.format, checkpoints, manifest, spill_threshold)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,175 @@
+# manifest.py
+
+import os
+import re
+import json
+import zipfile
+import logging
+from constant import BDC_FILE_PATTERN, BDC_US_PROVIDER_FILE_PATTERN
+from resources import STATE_BY_ABBR, get_state_info
+from prepdata import check_directory_structure
+
+# Bump when manifest entries change layout so every file is described again
+MANIFEST_VERSION = 2
+
+# Bytes read from the start of each file to estimate its rows from the mean line length
+ROW_SAMPLE_BYTES = 1 << 20
+
+BDC_FILE_REGEX = re.compile(BDC_FILE_PATTERN)
+BDC_US_PROVIDER_FILE_REGEX = re.compile(BDC_US_PROVIDER_FILE_PATTERN)
+
+STATE_DIRS = {f"{fips}_{abbr}_{name}" for fips, abbr, name in STATE_BY_ABBR.values()}
+
+def get_manifest_path(base_dir):
+    return os.path.join(base_dir, 'USA_FCC-bdc', '.cache', 'manifest.json')
+
+def estimate_rows(sample, total_size):
+    # Data rows of a CSV from its first bytes: exact when the sample is the whole file, otherwise the
+    # uncompressed size over the mean length of the sampled lines after the header
+    lines = sample.count(b'\n')
+    if len(sample) >= total_size:
+        return max(lines - 1 + (0 if sample.endswith(b'\n') else 1), 0)
+    if lines < 2:
+        return None
+    header_end = sample.find(b'\n') + 1
+    sampled_end = sample.rfind(b'\n') + 1
+    return round((total_size - header_end) * (lines - 1) / (sampled_end - header_end))
+
+def describe_bdc_file(file_path, technology, stat):
+    entry = {
+        "name": os.path.basename(file_path),
+        "technology": technology,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "members": [],
+        "uncompressed_size": stat.st_size,
+        "rows": None
+    }
+    try:
+        if file_path.endswith('.zip'):
+            with zipfile.ZipFile(file_path) as archive:
+                members = archive.infolist()
+                entry["members"] = [member.filename for member in members]
+                entry["uncompressed_size"] = sum(member.file_size for member in members)
+                if len(members) != 1:
+                    # read_csv only opens a zip holding exactly one file, so the reader will reject this one
+                    logging.warning(f"{file_path} holds {len(members)} files; only a zip with exactly one file can be read")
+                    return entry
+                # The estimate uses the member read_csv parses and its own uncompressed size
+                with archive.open(members[0]) as f:
+                    sample = f.read(ROW_SAMPLE_BYTES)
+        else:
+            with open(file_path, 'rb') as f:
+                sample = f.read(ROW_SAMPLE_BYTES)
+        entry["rows"] = estimate_rows(sample, entry["uncompressed_size"])
+    except (OSError, IndexError, zipfile.BadZipFile) as e:
+        # Left for the reader to report; the file is still listed so the state is not skipped silently
+        logging.warning(f"Could not read {file_path} while building the file manifest: {e}")
+    return entry
+
+class FileManifest:
+    # Every state's BDC files from one os.scandir pass over USA_FCC-bdc, shared by the file checks, the
+    # readers and the incremental store instead of each listing and regex-matching the directories again.
+    # Entries hold each file's technology, size, mtime, zip members and estimated rows, and are cached in
+    # USA_FCC-bdc/.cache/manifest.json; a cached entry is reused while its size and mtime still match, so
+    # zip directories are only opened and rows only sampled for new or changed files.
+    def __init__(self, base_dir, states, holder_mapping_file=None):
+        self.root = os.path.join(base_dir, 'USA_FCC-bdc')
+        self.states = states
+        self.holder_mapping_file = holder_mapping_file
+
+    @classmethod
+    def discover(cls, base_dir, use_cache=True):
+        check_directory_structure(base_dir)
+        manifest_path = get_manifest_path(base_dir)
+        cached = cls.load_cached(manifest_path) if use_cache else {}
+
+        root = os.path.join(base_dir, 'USA_FCC-bdc')
+        states = {}
+        holder_mapping_file = None
+        described = 0
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.name == 'resources' and entry.is_dir():
+                    holder_mapping_file = cls.find_holder_mapping_file(entry.path)
+                elif entry.name in STATE_DIRS and entry.is_dir():
+                    previous = {file_entry["name"]: file_entry for file_entry in cached.get(entry.name, [])}
+                    states[entry.name], new = cls.scan_state_dir(entry.path, previous)
+                    described += new
+
+        manifest = cls(base_dir, states, holder_mapping_file)
+        logging.info(f"Found {sum(len(files) for files in states.values())} BDC files in {len(states)} state directories "
+                     f"({described} new or changed since the cached manifest)")
+        if use_cache and states != cached:
+            manifest.save(manifest_path)
+        return manifest
+
+    @staticmethod
+    def load_cached(manifest_path):
+        try:
+            with open(manifest_path, 'r') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if cached.get("version") != MANIFEST_VERSION:
+            return {}
+        return cached["states"]
+
+    @staticmethod
+    def find_holder_mapping_file(resources_dir):
+        # Same choice as prepdata.find_holder_mapping_file: the provider list with the greatest date
+        files = []
+        with os.scandir(resources_dir) as entries:
+            for entry in entries:
+                match = BDC_US_PROVIDER_FILE_REGEX.match(entry.name)
+                if match:
+                    files.append((match.group(1), entry.name))
+        return os.path.join(resources_dir, max(files)[1]) if files else None
+
+    @staticmethod
+    def scan_state_dir(state_path, previous):
+        # Files stay in directory order, the order os.listdir gave the readers, so outputs are unchanged
+        files = []
+        described = 0
+        with os.scandir(state_path) as entries:
+            for entry in entries:
+                match = BDC_FILE_REGEX.match(entry.name)
+                if not match or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                file_entry = previous.get(entry.name)
+                if file_entry is None or file_entry["size"] != stat.st_size or file_entry["mtime_ns"] != stat.st_mtime_ns:
+                    file_entry = describe_bdc_file(entry.path, match.group(1), stat)
+                    described += 1
+                files.append(file_entry)
+        return files, described
+
+    def save(self, manifest_path):
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        temp_path = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({"version": MANIFEST_VERSION, "states": self.states}, f, indent=2)
+        os.replace(temp_path, manifest_path)
+
+    def state_dir(self, state_abbr):
+        fips, abbr, name = get_state_info(state_abbr)
+        return os.path.join(self.root, f"{fips}_{abbr}_{name}")
+
+    def get_bdc_files(self, state_abbr):
+        # Same result as readin.get_bdc_files, including the FileNotFoundError for a missing directory
+        bdc_dir = self.state_dir(state_abbr)
+        files = self.states.get(os.path.basename(bdc_dir))
+        if files is None:
+            raise FileNotFoundError(f"Required directory not found: {bdc_dir}")
+        return bdc_dir, [file_entry["name"] for file_entry in files]
+
+    def work_volume(self, state_abbr):
+        # Files, bytes on disk, uncompressed bytes and estimated rows a run would read for the state
+        files = self.states.get(os.path.basename(self.state_dir(state_abbr)), [])
+        return {
+            "files": len(files),
+            "bytes": sum(file_entry["size"] for file_entry in files),
+            "uncompressed_bytes": sum(file_entry["uncompressed_size"] for file_entry in files),
+            "rows": sum(file_entry["rows"] or 0 for file_entry in files),
+            "technologies": [file_entry["technology"] for file_entry in files]
+        }
@@ -0,0 +1,172 @@
+# metrics.py
+
+import io
+import os
+import csv
+import json
+import time
+import pstats
+import cProfile
+import logging
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak RSS is then left out
+    resource = None
+
+METRICS_FIELDS = ['state', 'stage', 'detail', 'seconds', 'rows', 'rows_per_sec', 'peak_rss_mb']
+
+# Stages recorded by main; any of them can be passed to --profile-stage
+STAGES = ['discover', 'resources', 'check_files', 'read', 'aggregate', 'blocks', 'h3', 'locations', 'write']
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return round(peak / (1024 ** 2 if os.uname().sysname == 'Darwin' else 1024), 1)
+
+class StageMetrics:
+    __slots__ = ('state', 'stage', 'detail', 'seconds', 'rows', 'peak_rss_mb')
+
+    def __init__(self, state, stage, detail=None, seconds=0.0, rows=0, peak_rss_mb=None):
+        self.state = state
+        self.stage = stage
+        self.detail = detail
+        self.seconds = seconds
+        self.rows = rows
+        self.peak_rss_mb = peak_rss_mb
+
+    @property
+    def rows_per_sec(self):
+        return round(self.rows / self.seconds, 1) if self.seconds > 0 else None
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "stage": self.stage,
+            "detail": self.detail,
+            "seconds": round(self.seconds, 6),
+            "rows": self.rows,
+            "rows_per_sec": self.rows_per_sec,
+            "peak_rss_mb": self.peak_rss_mb
+        }
+
+class RunMetrics:
+    # Wall time, rows and peak RSS per stage and state. Stage times are exclusive: time spent in a
+    # nested stage (e.g. reading the chunks an aggregation pulls) is only counted for the nested one.
+    # Peak RSS is the process high-water mark when the stage ends.
+    def __init__(self, profile_stage=None, profile_dir=None):
+        self.stages = []
+        self.profile_stage = profile_stage
+        self.profile_dir = profile_dir
+        self.profiles = {}
+        self.active = []  # [stage, state, seconds spent in nested stages] of each open stage
+        self.last_span = 0.0
+
+    def profiler(self, stage, state):
+        key = (stage, state)
+        if key not in self.profiles:
+            self.profiles[key] = cProfile.Profile()
+        return self.profiles[key]
+
+    @contextmanager
+    def span(self, stage, state):
+        # Times one stretch of work. The profiler only runs while the profiled stage itself is executing,
+        # so work done in stages nested inside it is left out of its profile, as it is of its time.
+        parent = self.active[-1] if self.active else None
+        if stage == self.profile_stage:
+            self.profiler(stage, state).enable()
+        elif parent is not None and parent[0] == self.profile_stage:
+            self.profiler(parent[0], parent[1]).disable()
+        self.active.append([stage, state, 0.0])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self.active.pop()[2]
+            if parent is not None:
+                parent[2] += elapsed
+            if stage == self.profile_stage:
+                self.profiler(stage, state).disable()
+            elif parent is not None and parent[0] == self.profile_stage:
+                self.profiler(parent[0], parent[1]).enable()
+            self.last_span = elapsed - nested
+
+    @contextmanager
+    def stage(self, stage, state=None, detail=None, rows=0):
+        record = StageMetrics(state, stage, detail, rows=rows)
+        with self.span(stage, state):
+            yield record
+        record.seconds = self.last_span
+        record.peak_rss_mb = peak_rss_mb()
+        self.add(record)
+
+    def timed_chunks(self, chunks, state=None, detail=None):
+        # Passes chunks through, charging the time spent producing them to a 'read' stage
+        record = StageMetrics(state, 'read', detail)
+        iterator = iter(chunks)
+        while True:
+            with self.span('read', state):
+                chunk = next(iterator, None)
+            record.seconds += self.last_span
+            if chunk is None:
+                break
+            record.rows += len(chunk)
+            yield chunk
+        record.peak_rss_mb = peak_rss_mb()
+        self.add(record)
+
+    def add(self, record):
+        self.stages.append(record)
+        detail = f" ({record.detail})" if record.detail else ""
+        rate = f" ({record.rows_per_sec:,.0f} rows/s)" if record.rows_per_sec else ""
+        logging.info(f"Stage {record.stage}{detail} [{record.state or 'all'}]: {record.seconds:.3f}s, "
+                     f"{record.rows} rows{rate}, peak RSS {record.peak_rss_mb} MB")
+
+    def extend(self, stages):
+        # Records measured in a worker process
+        self.stages.extend(stages)
+
+    def rows(self, state, stage):
+        return sum(record.rows for record in self.stages if record.state == state and record.stage == stage)
+
+    def state_totals(self):
+        totals = {}
+        for record in self.stages:
+            total = totals.setdefault(record.state or 'all', {"seconds": 0.0, "rows": 0, "peak_rss_mb": None})
+            total["seconds"] = round(total["seconds"] + record.seconds, 6)
+            if record.stage == 'read':
+                total["rows"] += record.rows
+            if record.peak_rss_mb is not None:
+                total["peak_rss_mb"] = max(total["peak_rss_mb"] or 0, record.peak_rss_mb)
+        return totals
+
+    def write(self, metrics_file):
+        # CSV gets one row per stage record; anything else is written as JSON with per-state totals
+        os.makedirs(os.path.dirname(os.path.abspath(metrics_file)), exist_ok=True)
+        if metrics_file.endswith('.csv'):
+            with open(metrics_file, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=METRICS_FIELDS)
+                writer.writeheader()
+                writer.writerows(record.to_dict() for record in self.stages)
+        else:
+            with open(metrics_file, 'w') as f:
+                json.dump({
+                    "stages": [record.to_dict() for record in self.stages],
+                    "states": self.state_totals()
+                }, f, indent=2)
+        logging.info(f"Run metrics written to: {metrics_file}")
+
+    def write_profiles(self):
+        profile_dir = self.profile_dir or os.getcwd()
+        for (stage, state), profiler in self.profiles.items():
+            os.makedirs(profile_dir, exist_ok=True)
+            profile_file = os.path.join(profile_dir, f"fccbdcsum_profile_{stage}_{state or 'all'}.prof")
+            profiler.dump_stats(profile_file)
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(15)
+            logging.info(f"Profile of stage {stage} [{state or 'all'}] written to: {profile_file}\n{summary.getvalue()}")
+        self.profiles = {}
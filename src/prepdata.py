@@ -11,23 +11,25 @@ def prepare_lookup_tables():
     state_dict = {abbr: (fips, name) for fips, abbr, name in STATES_AND_TERRITORIES}
     return state_dict
 
-def load_holder_mapping(base_dir):
-    logging.info(f"Preparing holder mapping data.")
+def find_holder_mapping_file(base_dir):
     resources_dir = os.path.join(base_dir, 'USA_FCC-bdc', 'resources')
     if not os.path.exists(resources_dir):
         raise FileNotFoundError(f"Resources directory not found: {resources_dir}")
     
-    # Find all files matching the pattern
-    files = [f for f in os.listdir(resources_dir) if re.match(BDC_US_PROVIDER_FILE_PATTERN, f)]
+    # Find all files matching the pattern, keeping the date found in group 1 of each match
+    matches = [(re.match(BDC_US_PROVIDER_FILE_PATTERN, f), f) for f in os.listdir(resources_dir)]
+    files = [(match.group(1), f) for match, f in matches if match]
     if not files:
         raise FileNotFoundError(f"No files matching pattern {BDC_US_PROVIDER_FILE_PATTERN} found in: {resources_dir}")
     
-    # Sort files by the date found in group 1 of the pattern match
-    files.sort(key=lambda f: re.search(BDC_US_PROVIDER_FILE_PATTERN, f).group(1), reverse=True)
-    
     # Use the most recent file
-    most_recent_file = files[0]
-    holder_mapping_file = os.path.join(resources_dir, most_recent_file)
+    most_recent_file = max(files)[1]
+    return os.path.join(resources_dir, most_recent_file)
+
+def load_holder_mapping(base_dir, holder_mapping_file=None):
+    logging.info(f"Preparing holder mapping data.")
+    if holder_mapping_file is None:
+        holder_mapping_file = find_holder_mapping_file(base_dir)
     
     holder_mapping_df = pd.read_csv(holder_mapping_file)
     holder_mapping = dict(zip(holder_mapping_df['provider_id'], holder_mapping_df['holding_company']))
@@ -49,10 +51,11 @@ def check_directory_structure(base_dir):
         if not os.path.exists(directory):
             raise FileNotFoundError(f"Required directory does not exist: {directory}")
 
-def prepare_data(base_dir, state):
+def prepare_data(base_dir, state, manifest=None):
     logging.info(f"Preparing data for state: {state}")
-    # Function to prepare data
-    check_directory_structure(base_dir)
+    # Function to prepare data; a file manifest was only built after the directory structure was checked
+    if manifest is None:
+        check_directory_structure(base_dir)
     lookup_tables = prepare_lookup_tables()
     fcc_bdc_df = prepare_dataframes()
     # Additional data preparation logic can be added here
@@ -0,0 +1,245 @@
+# query.py
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from functools import lru_cache
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from aggregate import LOCATION_TYPES
+from writeout import open_output, find_latest_output
+from tables import load_provider_map, TABLE_FORMATS
+
+DEFAULT_CACHE_SIZE = 1024
+
+DEFAULT_PORT = 8080
+
+# Query parameters, in cache-key order; speeds are parsed as ints
+QUERY_FILTERS = ['state', 'county', 'provider', 'technology', 'location_type', 'min_download', 'min_upload']
+
+class CountyOffering:
+    # One technology of one provider in one county, pointing at its subtree of the loaded output
+    __slots__ = ('provider', 'provider_id', 'state', 'county', 'technology', 'data', 'max_download_speed', 'max_upload_speed')
+
+    def __init__(self, provider, provider_id, state, county, technology, data):
+        self.provider = provider
+        self.provider_id = provider_id
+        self.state = state
+        self.county = county
+        self.technology = technology
+        self.data = data
+        tiers = [tier for location_type in LOCATION_TYPES for tier in data.get(location_type, {}).get("locations", [])]
+        self.max_download_speed = max((tier["max_download_speed"] for tier in tiers), default=0)
+        self.max_upload_speed = max((tier["max_upload_speed"] for tier in tiers), default=0)
+
+    def to_dict(self, location_types=LOCATION_TYPES, min_download=0, min_upload=0):
+        # Speed tiers below the minimum speeds are left out, and the totals count only the tiers kept
+        result = {
+            "provider": self.provider,
+            "provider_id": self.provider_id,
+            "state": self.state,
+            "county": self.county,
+            "technology": self.technology,
+            "total_locations": 0
+        }
+        for location_type in location_types:
+            tiers = [tier for tier in self.data.get(location_type, {}).get("locations", [])
+                     if tier["max_download_speed"] >= min_download and tier["max_upload_speed"] >= min_upload]
+            if tiers:
+                total = sum(tier["count"] for tier in tiers)
+                result[location_type] = {"total_locations": total, "locations": tiers}
+                result["total_locations"] += total
+        return result
+
+def normalize_key(key):
+    return key.strip().casefold()
+
+def technology_keys(tech_key):
+    # Technologies match on the full key ("Fiber, 50"), the abbreviation or the code
+    return {normalize_key(key) for key in (tech_key, *tech_key.split(', '))}
+
+def matches(offering, attribute, key):
+    if attribute == 'technology':
+        return key in technology_keys(offering.technology)
+    return normalize_key(getattr(offering, attribute)) == key
+
+class QueryIndex:
+    # A consolidated output loaded once and indexed by county, state, provider and technology. Each index
+    # maps a normalized key to the offerings carrying it; a query starts from its most selective index
+    # and filters the rest. Encoded results are kept in an LRU cache keyed by the normalized filters.
+    def __init__(self, provider_map, cache_size=DEFAULT_CACHE_SIZE):
+        self.offerings = []
+        self.by_county = {}
+        self.by_state = {}
+        self.by_provider = {}
+        self.by_technology = {}
+        for provider, provider_data in provider_map.items():
+            for state_key, state_data in provider_data.get("states", {}).items():
+                for county_key, county_data in state_data.get("counties", {}).items():
+                    for tech_key, tech_data in county_data.get("technologies", {}).items():
+                        self.add(CountyOffering(provider, provider_data.get("provider_id"), state_key, county_key, tech_key, tech_data))
+        self.cached_query = lru_cache(maxsize=cache_size)(self.encode_query)
+
+    @classmethod
+    def load(cls, output_file, cache_size=DEFAULT_CACHE_SIZE):
+        start = time.perf_counter()
+        if output_file.endswith(tuple(TABLE_FORMATS.values())):
+            provider_map = load_provider_map(output_file)
+        else:
+            with open_output(output_file, 'r') as f:
+                provider_map = json.load(f)
+        loaded = time.perf_counter()
+        index = cls(provider_map, cache_size)
+        logging.info(f"Loaded {output_file} in {loaded - start:.3f}s and indexed {len(index.offerings)} county offerings "
+                     f"of {len(index.by_provider)} providers in {len(index.by_county)} counties in {time.perf_counter() - loaded:.3f}s")
+        return index
+
+    def add(self, offering):
+        position = len(self.offerings)
+        self.offerings.append(offering)
+        self.by_county.setdefault(normalize_key(offering.county), []).append(position)
+        self.by_state.setdefault(normalize_key(offering.state), []).append(position)
+        self.by_provider.setdefault(normalize_key(offering.provider), []).append(position)
+        for tech_key in technology_keys(offering.technology):
+            self.by_technology.setdefault(tech_key, []).append(position)
+
+    def query(self, state=None, county=None, provider=None, technology=None, location_type=None, min_download=0, min_upload=0):
+        # Offerings matching every filter given, in output order. Unknown keys match nothing.
+        filters = [(index, attribute, normalize_key(key)) for index, attribute, key in (
+            (self.by_county, 'county', county), (self.by_provider, 'provider', provider),
+            (self.by_state, 'state', state), (self.by_technology, 'technology', technology)) if key is not None]
+        if filters:
+            index, attribute, key = min(filters, key=lambda entry: len(entry[0].get(entry[2], ())))
+            positions = index.get(key, ())
+            checks = [(other_attribute, other_key) for _, other_attribute, other_key in filters if other_attribute != attribute]
+        else:
+            positions = range(len(self.offerings))
+            checks = []
+
+        location_types = LOCATION_TYPES if location_type is None else (location_type.upper(),)
+        results = []
+        for position in positions:
+            offering = self.offerings[position]
+            if offering.max_download_speed < min_download or offering.max_upload_speed < min_upload:
+                continue
+            if any(not matches(offering, attribute, key) for attribute, key in checks):
+                continue
+            result = offering.to_dict(location_types, min_download, min_upload)
+            if result["total_locations"]:
+                results.append(result)
+        return results
+
+    def encode_query(self, *filters):
+        return json.dumps(self.query(*filters)).encode('utf-8')
+
+    def lookup(self, **filters):
+        # JSON-encoded query results, through the LRU cache; filters are normalized so equivalent queries share an entry
+        key = tuple(parse_filter(name, filters.get(name)) for name in QUERY_FILTERS)
+        return self.cached_query(*key)
+
+    def keys(self, name):
+        attribute = {"counties": "county", "states": "state", "providers": "provider", "technologies": "technology"}[name]
+        return sorted({getattr(offering, attribute) for offering in self.offerings})
+
+    def stats(self):
+        info = self.cached_query.cache_info()
+        return {
+            "offerings": len(self.offerings),
+            "providers": len(self.by_provider),
+            "counties": len(self.by_county),
+            "cache": {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
+        }
+
+def parse_filter(name, value):
+    if name in ('min_download', 'min_upload'):
+        return int(value) if value not in (None, '') else 0
+    if value is None or value == '':
+        return None
+    if name == 'location_type':
+        if value.strip().upper() not in LOCATION_TYPES:
+            raise ValueError(f"location_type must be one of {LOCATION_TYPES}: {value!r}")
+        return value.strip().upper()
+    return normalize_key(value)
+
+class QueryHandler(BaseHTTPRequestHandler):
+    # GET /query?county=...&provider=...&technology=...&min_download=...; GET /counties, /states, /providers,
+    # /technologies and /stats. The QueryIndex is shared by all request threads through the server.
+    def do_GET(self):
+        url = urlparse(self.path)
+        index = self.server.index
+        try:
+            if url.path == '/query':
+                params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+                unknown = [name for name in params if name not in QUERY_FILTERS]
+                if unknown:
+                    raise ValueError(f"Unknown query parameters: {unknown}")
+                body = index.lookup(**params)
+            elif url.path.strip('/') in ('counties', 'states', 'providers', 'technologies'):
+                body = json.dumps(index.keys(url.path.strip('/'))).encode('utf-8')
+            elif url.path == '/stats':
+                body = json.dumps(index.stats()).encode('utf-8')
+            else:
+                self.send_error(404, f"Unknown path: {url.path}")
+                return
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+def make_server(index, host='127.0.0.1', port=DEFAULT_PORT):
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.index = index
+    return server
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Query a consolidated fccbdcsum output from the command line or over local HTTP.')
+    parser.add_argument('-d', '--base-dir', type=str, default=os.getcwd(), help='Base directory; the latest output in USA_FCC-bdc is used')
+    parser.add_argument('-f', '--file', type=str, help='Output file (JSON, Parquet or Arrow) to query instead of the latest JSON')
+    parser.add_argument('--state', type=str, help='State key, e.g. "Florida, 12"')
+    parser.add_argument('--county', type=str, help='County key, e.g. "Miami-Dade County, 12"')
+    parser.add_argument('--provider', type=str, help='Provider (brand) name')
+    parser.add_argument('--technology', type=str, help='Technology key, abbreviation or code, e.g. Fiber or 50')
+    parser.add_argument('--location-type', choices=LOCATION_TYPES, help='Only this location type')
+    parser.add_argument('--min-download', type=int, default=0, help='Only speed tiers with at least this download speed')
+    parser.add_argument('--min-upload', type=int, default=0, help='Only speed tiers with at least this upload speed')
+    parser.add_argument('--serve', action='store_true', help='Serve queries over HTTP instead of answering one')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to serve on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port to serve on')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE, help='Query results kept in the LRU cache')
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    output_file = args.file or find_latest_output(os.path.join(args.base_dir, 'USA_FCC-bdc'))
+    if output_file is None:
+        logging.error(f"No fccbdcsum output found in {os.path.join(args.base_dir, 'USA_FCC-bdc')}")
+        sys.exit(1)
+    index = QueryIndex.load(output_file, args.cache_size)
+
+    if args.serve:
+        server = make_server(index, args.host, args.port)
+        logging.info(f"Serving queries on http://{args.host}:{server.server_address[1]}/query")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    filters = {name: getattr(args, name) for name in QUERY_FILTERS}
+    print(json.dumps(index.query(*(parse_filter(name, value) for name, value in filters.items())), indent=2))
+
+if __name__ == '__main__':
+    main()
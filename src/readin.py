@@ -2,63 +2,182 @@
 
 import os
 import re
+import queue
 import logging
+import threading
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
-from constant import BDC_FILE_PATTERN, STATES_AND_TERRITORIES
+from constant import BDC_FILE_PATTERN
+from resources import get_state_info
 
-def get_state_info(state_abbr):
-    for fips, abbr, name in STATES_AND_TERRITORIES:
-        if abbr == state_abbr:
-            return fips.zfill(2), abbr, name.replace(' ', '_')  # Ensure FIPS code is zero-padded and spaces are replaced by underscores
-    raise ValueError(f"State abbreviation {state_abbr} not found in STATES_AND_TERRITORIES")
+def check_required_files(base_dir, state_abbr, manifest=None):
+    if manifest is not None:
+        # The manifest raises the same FileNotFoundError for a missing state directory
+        bdc_dir, bdc_files = manifest.get_bdc_files(state_abbr)
+    else:
+        fips, abbr, name = get_state_info(state_abbr)
+        state_dir = f"{fips}_{abbr}_{name}"
 
-def check_required_files(base_dir, state_abbr):
-    fips, abbr, name = get_state_info(state_abbr)
-    state_dir = f"{fips}_{abbr}_{name}"
-    
-    bdc_dir = os.path.join(base_dir, 'USA_FCC-bdc', state_dir)
+        bdc_dir = os.path.join(base_dir, 'USA_FCC-bdc', state_dir)
 
-    if not os.path.exists(bdc_dir):
-        raise FileNotFoundError(f"Required directory not found: {bdc_dir}")
-    
-    bdc_files = [f for f in os.listdir(bdc_dir) if re.match(BDC_FILE_PATTERN, f)]
+        if not os.path.exists(bdc_dir):
+            raise FileNotFoundError(f"Required directory not found: {bdc_dir}")
+
+        bdc_files = [f for f in os.listdir(bdc_dir) if re.match(BDC_FILE_PATTERN, f)]
 
     if not bdc_files:
         raise FileNotFoundError(f"No BDC files found in: {bdc_dir}")
     
     return bdc_files
 
-def combine_bdc_files(base_dir, state_abbr):
+# Fields kept from each BDC file, with dtypes pinned so pandas does not have to infer them per chunk
+BDC_COLUMNS = ['frn', 'provider_id', 'brand_name', 'location_id', 'technology',
+               'max_advertised_download_speed', 'max_advertised_upload_speed',
+               'low_latency', 'business_residential_code', 'state_usps',
+               'block_geoid', 'h3_res8_id']
+
+BDC_DTYPES = {
+    'frn': 'str',
+    'provider_id': 'int64',
+    'brand_name': 'str',
+    'location_id': 'int64',
+    'technology': 'category',
+    'max_advertised_download_speed': 'int64',
+    'max_advertised_upload_speed': 'int64',
+    'low_latency': 'int64',
+    'business_residential_code': 'category',
+    'state_usps': 'category',
+    'block_geoid': 'str',
+    'h3_res8_id': 'str'
+}
+
+DEFAULT_CHUNKSIZE = 1_000_000
+
+# Parsed chunks each prefetching file may hold before its reader waits for the consumer
+PREFETCH_QUEUE_CHUNKS = 2
+
+def get_bdc_files(base_dir, state_abbr, manifest=None):
+    if manifest is not None:
+        return manifest.get_bdc_files(state_abbr)
     fips, abbr, name = get_state_info(state_abbr)
     state_dir = f"{fips}_{abbr}_{name}"
     
     bdc_dir = os.path.join(base_dir, 'USA_FCC-bdc', state_dir)
     bdc_files = [f for f in os.listdir(bdc_dir) if re.match(BDC_FILE_PATTERN, f)]
+    return bdc_dir, bdc_files
+
+def read_bdc_file(file_path, chunksize=None):
+    compression = 'zip' if file_path.endswith('.zip') else None
+    return pd.read_csv(file_path, compression=compression, encoding='ISO-8859-1',  # Adjust encoding as needed
+                       usecols=BDC_COLUMNS, dtype=BDC_DTYPES, chunksize=chunksize)
+
+def read_bdc_chunks(file_path, chunksize=DEFAULT_CHUNKSIZE):
+    with read_bdc_file(file_path, chunksize=chunksize) as reader:
+        for chunk in reader:
+            # Ensure block_geoid is treated as a 15-digit ID. Series.map is used instead of the .str
+            # accessor, whose cached reference cycle keeps every chunk alive until the next GC pass.
+            if (chunk['block_geoid'].map(len) != 15).any():
+                chunk['block_geoid'] = chunk['block_geoid'].map(lambda geoid: geoid.zfill(15))
+            # read_csv parses category labels as strings; technology codes must stay integers
+            technology = chunk['technology'].cat
+            chunk['technology'] = technology.rename_categories(technology.categories.astype('int64'))
+            yield chunk[BDC_COLUMNS]
+
+def iter_file_chunks(file_path, chunksize=DEFAULT_CHUNKSIZE, cache=None):
+    chunks = read_bdc_chunks(file_path, chunksize)
+    if cache is not None:
+        chunks = cache.read_chunks(file_path, chunks)
+    return chunks
+
+def fill_chunk_queue(chunks, chunk_queue, stop):
+    # Runs on a prefetch thread: parses one file's chunks into its bounded queue, then a None sentinel.
+    # Errors are handed to the consumer through the queue; `stop` is set when the consumer gives up.
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunk_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        for chunk in chunks:
+            if not put(chunk):
+                return
+        put(None)
+    except BaseException as e:
+        put(e)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def drain_chunk_queue(chunk_queue):
+    while True:
+        item = chunk_queue.get()
+        if item is None:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+def prefetch_chunks(file_chunks, workers, depth=PREFETCH_QUEUE_CHUNKS):
+    # Yields one chunk iterator per file, in order, while the file being consumed and up to `workers` - 1
+    # files after it are decompressed and parsed on a thread pool. A new file is only started once an
+    # earlier one has been consumed, so at most workers * (depth + 1) chunks are held at once.
+    file_chunks = iter(file_chunks)
+    stop = threading.Event()
+    pending = []
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bdc-prefetch')
+
+    def submit_next():
+        chunks = next(file_chunks, None)
+        if chunks is not None:
+            chunk_queue = queue.Queue(maxsize=depth)
+            executor.submit(fill_chunk_queue, chunks, chunk_queue, stop)
+            pending.append(chunk_queue)
+
+    try:
+        for _ in range(workers):
+            submit_next()
+        while pending:
+            yield drain_chunk_queue(pending[0])
+            pending.pop(0)
+            submit_next()
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def iter_bdc_chunks(base_dir, state_abbr, chunksize=DEFAULT_CHUNKSIZE, cache=None, metrics=None, prefetch=0, manifest=None):
+    bdc_dir, bdc_files = get_bdc_files(base_dir, state_abbr, manifest)
     
     logging.info(f"Processing BDC files: {bdc_files}")
     
-    combined_df = pd.DataFrame()
-    for i, bdc_file in enumerate(tqdm(bdc_files, desc="Processing BDC files")):
-        file_path = os.path.join(bdc_dir, bdc_file)
-        if bdc_file.endswith('.csv'):
-            df = pd.read_csv(file_path, encoding='ISO-8859-1')  # Adjust encoding as needed
-        elif bdc_file.endswith('.zip'):
-            df = pd.read_csv(file_path, compression='zip', encoding='ISO-8859-1')  # Adjust encoding as needed
-        
-        combined_df = pd.concat([combined_df, df], ignore_index=True)
-    
-    # Ensure block_geoid is treated as a 15-digit ID
-    combined_df['block_geoid'] = combined_df['block_geoid'].apply(lambda x: str(int(x)).zfill(15))
-    
-    # Select required fields
-    combined_df = combined_df[['frn', 'provider_id', 'brand_name', 'location_id', 'technology', 
-                               'max_advertised_download_speed', 'max_advertised_upload_speed', 
-                               'low_latency', 'business_residential_code', 'state_usps', 
-                               'block_geoid', 'h3_res8_id']]
+    file_chunks = (iter_file_chunks(os.path.join(bdc_dir, bdc_file), chunksize, cache) for bdc_file in bdc_files)
+    if prefetch > 0:
+        # Later files are parsed on threads while the current one is aggregated; reading time left
+        # in the 'read' stage is then the time spent waiting on the prefetch queue
+        file_chunks = prefetch_chunks(file_chunks, prefetch)
+    for bdc_file, chunks in zip(tqdm(bdc_files, desc="Processing BDC files"), file_chunks):
+        if metrics is not None:
+            chunks = metrics.timed_chunks(chunks, state_abbr, bdc_file)
+        yield from chunks
+
+def combine_bdc_files(base_dir, state_abbr, chunksize=DEFAULT_CHUNKSIZE, metrics=None, prefetch=0):
+    chunks = list(iter_bdc_chunks(base_dir, state_abbr, chunksize, metrics=metrics, prefetch=prefetch))
+    if not chunks:
+        return pd.DataFrame({column: [] for column in BDC_COLUMNS})
     
-    return combined_df
+    # Concatenate once; categories differ between chunks, so re-pin them on the combined frame
+    combined_df = pd.concat(chunks, ignore_index=True)
+    categoricals = [column for column, dtype in BDC_DTYPES.items() if dtype == 'category']
+    return combined_df.astype({column: 'category' for column in categoricals})
+
+def read_data(base_dir, state_abbr, metrics=None, prefetch=0):
+    check_required_files(base_dir, state_abbr)
+    return combine_bdc_files(base_dir, state_abbr, metrics=metrics, prefetch=prefetch)
 
-def read_data(base_dir, state_abbr):
+def read_data_chunks(base_dir, state_abbr, chunksize=DEFAULT_CHUNKSIZE, cache=None, metrics=None, prefetch=0):
     check_required_files(base_dir, state_abbr)
-    return combine_bdc_files(base_dir, state_abbr)
\ No newline at end of file
+    return iter_bdc_chunks(base_dir, state_abbr, chunksize, cache, metrics, prefetch)
@@ -0,0 +1,117 @@
+# readout.py
+
+import os
+import json
+import logging
+from aggregate import decode_speed_tiers
+
+# Bump when the index layout changes; older indexes are then ignored
+INDEX_VERSION = 1
+
+INDEX_SUFFIX = '.idx'
+
+def get_index_path(output_file):
+    return output_file + INDEX_SUFFIX
+
+class EncodedProvider:
+    # A provider subtree already encoded as JSON text, with its states and counties indexed by offsets
+    # relative to the start of the text. Lets unchanged providers be copied between outputs unparsed.
+    __slots__ = ('text', 'states', 'indent')
+
+    def __init__(self, text, states, indent):
+        self.text = text
+        self.states = states
+        self.indent = indent
+
+    def decode(self):
+        return json.loads(self.text, object_hook=decode_speed_tiers)
+
+class IndexedOutput:
+    # Random access to a consolidated JSON output through its sidecar index:
+    #   [[provider, offset, length, [[state, offset, length, [[county, offset, length], ...]], ...]], ...]
+    # Offsets and lengths are in bytes; outputs are ASCII, so they match character positions.
+    def __init__(self, output_file, index):
+        self.output_file = output_file
+        self.indent = index["indent"]
+        self.providers = {entry[0]: entry[1:] for entry in index["providers"]}
+        self.county_index = None
+        self.file = open(output_file, 'rb')
+
+    @classmethod
+    def open(cls, output_file):
+        # Returns None when there is no usable index, so callers can fall back to json.load
+        try:
+            with open(get_index_path(output_file), 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if index.get("version") != INDEX_VERSION or index.get("size") != os.path.getsize(output_file):
+            logging.warning(f"Ignoring stale index for {output_file}")
+            return None
+        return cls(output_file, index)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        return iter(list(self.providers))
+
+    def __len__(self):
+        return len(self.providers)
+
+    def __contains__(self, provider):
+        return provider in self.providers
+
+    def read_text(self, offset, length):
+        self.file.seek(offset)
+        return self.file.read(length).decode('ascii')
+
+    def load(self, offset, length, speed_tiers=False):
+        return json.loads(self.read_text(offset, length), object_hook=decode_speed_tiers if speed_tiers else None)
+
+    def load_provider(self, provider, speed_tiers=False):
+        offset, length, states = self.providers[provider]
+        return self.load(offset, length, speed_tiers)
+
+    def load_state(self, provider, state, speed_tiers=False):
+        for state_key, offset, length, counties in self.providers[provider][2]:
+            if state_key == state:
+                return self.load(offset, length, speed_tiers)
+        raise KeyError(state)
+
+    def load_county(self, provider, state, county, speed_tiers=False):
+        for state_key, state_offset, state_length, counties in self.providers[provider][2]:
+            if state_key == state:
+                for county_key, offset, length in counties:
+                    if county_key == county:
+                        return self.load(offset, length, speed_tiers)
+        raise KeyError(county)
+
+    def county_providers(self, county):
+        # {provider: county subtree} for every provider serving the county (county keys look like "Name, SS")
+        if self.county_index is None:
+            self.county_index = {}
+            for provider, (offset, length, states) in self.providers.items():
+                for state_key, state_offset, state_length, counties in states:
+                    for county_key, county_offset, county_length in counties:
+                        self.county_index.setdefault(county_key, []).append((provider, county_offset, county_length))
+        return {provider: self.load(offset, length) for provider, offset, length in self.county_index.get(county, [])}
+
+    def encoded_provider(self, provider):
+        offset, length, states = self.providers[provider]
+        relative = [[state_key, state_offset - offset, state_length,
+                     [[county_key, county_offset - offset, county_length] for county_key, county_offset, county_length in counties]]
+                    for state_key, state_offset, state_length, counties in states]
+        return EncodedProvider(self.read_text(offset, length), relative, self.indent)
+
+    def pop(self, provider):
+        # Mirrors dict.pop for iter_merged_providers: loads the provider ready for merging
+        provider_data = self.load_provider(provider, speed_tiers=True)
+        del self.providers[provider]
+        return provider_data
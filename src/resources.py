@@ -0,0 +1,117 @@
+# resources.py
+
+import os
+import pickle
+import logging
+import numpy as np
+from constant import STATES_AND_TERRITORIES
+from prepdata import find_holder_mapping_file, load_holder_mapping
+
+# Bump when the cached resource layout changes
+RESOURCES_VERSION = 1
+
+# State lookups built once at import instead of scanning STATES_AND_TERRITORIES per call
+STATE_BY_ABBR = {abbr: (fips.zfill(2), abbr, name.replace(' ', '_')) for fips, abbr, name in STATES_AND_TERRITORIES}
+STATE_NAME_BY_FIPS = {fips: name for fips, abbr, name in STATES_AND_TERRITORIES}
+
+# County GEOIDs are 5-digit SSCCC codes, so every county fits a dense array of this size
+COUNTY_FIPS_SIZE = 100000
+
+COUNTY_DIGIT_WEIGHTS = np.array([10000, 1000, 100, 10, 1], dtype=np.int32)
+
+def get_state_info(state_abbr):
+    try:
+        return STATE_BY_ABBR[state_abbr]  # FIPS code zero-padded and spaces replaced by underscores
+    except KeyError:
+        raise ValueError(f"State abbreviation {state_abbr} not found in STATES_AND_TERRITORIES")
+
+def get_resources_dir(base_dir):
+    return os.path.join(base_dir, 'USA_FCC-bdc', 'resources')
+
+def get_county_adjacency_file(base_dir):
+    return os.path.join(get_resources_dir(base_dir), 'county_adjacency2024.txt')
+
+def load_county_mapping(base_dir):
+    county_mapping = {}
+    file_path = get_county_adjacency_file(base_dir)
+    logging.info(f"Loading county mapping from {file_path}")
+    try:
+        with open(file_path, 'r') as f:
+            for line in f:
+                if line.startswith("County Name"):
+                    continue
+                parts = line.strip().split('|')
+                county_name = parts[0]
+                county_geoid = parts[1]
+                state_fips = county_geoid[:2]
+                county_mapping[county_geoid] = (state_fips, county_name)
+        logging.info("County mapping loaded successfully")
+    except FileNotFoundError as e:
+        logging.error(f"County adjacency file not found: {e}")
+        raise
+    return county_mapping
+
+class CountyIndex(dict):
+    # county_geoid -> (state_fips, county_name), like load_county_mapping, plus precomputed output keys:
+    # state_keys[i] and county_keys[i] are the keys of county i, and lookup[int(county_geoid)] is i
+    # (-1 for unknown counties or counties outside STATES_AND_TERRITORIES)
+    def __init__(self, county_mapping):
+        super().__init__(county_mapping)
+        self.state_keys = []
+        self.county_keys = []
+        self.lookup = np.full(COUNTY_FIPS_SIZE, -1, dtype=np.int32)
+        for county_geoid, (state_fips, county_name) in county_mapping.items():
+            state_name = STATE_NAME_BY_FIPS.get(state_fips)
+            if state_name is None or len(county_geoid) != 5 or not county_geoid.isdigit():
+                continue
+            self.lookup[int(county_geoid)] = len(self.state_keys)
+            self.state_keys.append(f"{state_name}, {state_fips}")
+            self.county_keys.append(f"{county_name}, {state_fips}")
+
+    def positions(self, county_geoids):
+        # Positions in self.keys for a 'U5' array of county GEOIDs, decoded straight from the UCS-4 code
+        # points. Returns None when any GEOID is not five digits so the caller can fall back to dict lookups.
+        digits = county_geoids.view(np.uint32).reshape(-1, 5).astype(np.int32) - ord('0')
+        if not ((digits >= 0) & (digits <= 9)).all():
+            return None
+        return self.lookup[digits @ COUNTY_DIGIT_WEIGHTS]
+
+class Resources:
+    # Lookup tables shared by every state of a run, pickled under USA_FCC-bdc/.cache between runs
+    def __init__(self, counties, holder_mapping, signature):
+        self.counties = counties
+        self.holder_mapping = holder_mapping
+        self.signature = signature
+
+def source_signature(paths):
+    signature = [RESOURCES_VERSION]
+    for path in paths:
+        stat = os.stat(path)
+        signature.append((os.path.basename(path), stat.st_size, stat.st_mtime_ns))
+    return signature
+
+def load_resources(base_dir, use_cache=True, holder_mapping_file=None):
+    # Raises FileNotFoundError if the resources directory or the provider list is missing
+    holder_mapping_file = holder_mapping_file or find_holder_mapping_file(base_dir)
+    sources = [get_county_adjacency_file(base_dir), holder_mapping_file]
+    signature = source_signature([path for path in sources if os.path.exists(path)])
+    cache_file = os.path.join(base_dir, 'USA_FCC-bdc', '.cache', 'resources.pkl')  # Alongside the BDC file cache
+
+    if use_cache and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'rb') as f:
+                resources = pickle.load(f)
+            if resources.signature == signature:
+                logging.info(f"Loaded cached resources from {cache_file}")
+                return resources
+        except (OSError, pickle.UnpicklingError, AttributeError, EOFError) as e:
+            logging.warning(f"Ignoring unreadable resource cache {cache_file}: {e}")
+
+    resources = Resources(CountyIndex(load_county_mapping(base_dir)), load_holder_mapping(base_dir, holder_mapping_file), signature)
+    if use_cache:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        temp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(temp_file, 'wb') as f:
+            pickle.dump(resources, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_file)
+    return resources
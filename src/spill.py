@@ -0,0 +1,278 @@
+# spill.py
+
+import os
+import shutil
+import logging
+import tempfile
+import psutil
+import numpy as np
+import pandas as pd
+from constant import TECH_ABBR_MAPPING
+from aggregate import REQUIRED_BDC_COLUMNS, resolve_counties, group_reduce, empty_tier_table, aggregate_bdc_chunks
+
+# Partials smaller than this fraction of the threshold are not worth spilling; RSS above the threshold is then
+# raw chunks and allocator slack, which spilling would not free
+MIN_SPILL_FRACTION = 1 / 32
+
+# Rows read per step of the k-way merge, split between the runs
+MERGE_BLOCK_ROWS = 1 << 16
+
+# Columns of a run: five key codes (provider, county, technology, location type, speed tier), the summed
+# count and the ordinal of the first record with the key
+KEY_COLUMNS = 5
+COUNT_COLUMN = 5
+FIRST_COLUMN = 6
+
+class SpillThreshold:
+    # RSS of one process above which partial aggregates are spilled, checked with psutil after each chunk.
+    # It is not a cap: raw chunks, the final merge and the tier table are still held in memory. Spilled
+    # runs go to temporary directories under spill_dir (the system temp directory if None).
+    def __init__(self, threshold_mb, spill_dir=None):
+        self.threshold_mb = threshold_mb
+        self.threshold = int(threshold_mb * 1024 ** 2)
+        self.spill_dir = spill_dir
+
+    def rss(self):
+        return psutil.Process().memory_info().rss
+
+    def should_spill(self, partial_bytes):
+        return partial_bytes >= self.threshold * MIN_SPILL_FRACTION and self.rss() > self.threshold
+
+    def share(self, workers):
+        # Each of `workers` processes gets an equal part of the threshold
+        return SpillThreshold(self.threshold_mb / workers, self.spill_dir)
+
+class KeyCodes:
+    # Dense codes for key values in order of first appearance, shared by every chunk and run of a state so
+    # codes compare the same way in all of them. NaN is stored as None so it matches itself.
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode_uniques(self, uniques):
+        result = np.empty(len(uniques), dtype=np.int64)
+        for i, value in enumerate(uniques):
+            if value != value:
+                value = None
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.values)
+                self.values.append(value)
+            result[i] = code
+        return result
+
+    def encode(self, values):
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        return self.encode_uniques(uniques.tolist())[codes]
+
+class SpilledRun:
+    # A sorted run written with ndarray.tofile, read back a block at a time; unlike a memory map, blocks
+    # already merged do not stay resident and count towards the threshold
+    def __init__(self, path, run):
+        self.path = path
+        self.rows = len(run)
+        run.tofile(path)
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, rows):
+        start, stop, _ = rows.indices(self.rows)
+        width = FIRST_COLUMN + 1
+        block = np.fromfile(self.path, dtype=np.int64, count=max(stop - start, 0) * width, offset=start * width * 8)
+        return block.reshape(-1, width)
+
+def categorical(values, codes):
+    # The column astype('category') would give for np.array(values, dtype=object)[codes], built from the
+    # codes without materializing the object column
+    used = np.unique(codes)
+    used_values = pd.Series([values[code] for code in used.tolist()], dtype=object)
+    dtype = used_values.astype('category').dtype
+    lookup = np.full(len(values), -1, dtype=np.int64)
+    lookup[used] = dtype.categories.get_indexer(used_values)
+    return pd.Categorical.from_codes(lookup[codes], dtype=dtype)
+
+def reduce_rows(keys, counts, firsts):
+    # Sorted, distinct-key run: summed counts and the smallest first-record ordinal of each key
+    keys, (counts,), (firsts,) = group_reduce(keys, [counts], [-firsts])
+    return np.column_stack(keys + [counts, -firsts]).astype(np.int64)
+
+def merge_runs(runs, sizes, block_rows=MERGE_BLOCK_ROWS):
+    # k-way merge of sorted runs, block by block. Keys are packed into one int64 with the code counts in
+    # `sizes`. Every step reads the next block of each run; no run can still hold a key at or below the
+    # smallest last key of the blocks that stop short of their run's end, so all rows up to it are reduced
+    # and emitted. Runs hold distinct keys, so each key is emitted exactly once.
+    weights = []
+    capacity = 1
+    for size in reversed(sizes):
+        weights.append(capacity)
+        capacity *= max(size, 1)
+    if capacity >= 2 ** 63:
+        raise OverflowError(f"Too many distinct key combinations to pack into int64: {capacity}")
+    weights = np.array(weights[::-1], dtype=np.int64)
+    block_rows = max(block_rows // max(len(runs), 1), 1024)
+
+    # Sized for every run row, but only the pages written are ever resident
+    merged = np.empty((sum(len(run) for run in runs), FIRST_COLUMN + 1), dtype=np.int64)
+    merged_rows = 0
+    positions = [0] * len(runs)
+    while any(position < len(run) for run, position in zip(runs, positions)):
+        blocks = []
+        limit = None
+        for run, position in zip(runs, positions):
+            block = np.asarray(run[position:position + block_rows])
+            packed = block[:, :KEY_COLUMNS] @ weights
+            blocks.append((block, packed))
+            if position + block_rows < len(run):
+                limit = packed[-1] if limit is None else min(limit, packed[-1])
+
+        taken = []
+        for i, (block, packed) in enumerate(blocks):
+            cut = len(packed) if limit is None else int(np.searchsorted(packed, limit, side='right'))
+            positions[i] += cut
+            if cut:
+                taken.append((block[:cut], packed[:cut]))
+        rows = np.concatenate([block for block, packed in taken])
+        packed = np.concatenate([packed for block, packed in taken])
+        order = np.argsort(packed, kind='stable')
+        rows, packed = rows[order], packed[order]
+        starts = np.flatnonzero(np.concatenate(([True], packed[1:] != packed[:-1])))
+        reduced = merged[merged_rows:merged_rows + len(starts)]
+        reduced[:] = rows[starts]
+        reduced[:, COUNT_COLUMN] = np.add.reduceat(rows[:, COUNT_COLUMN], starts)
+        reduced[:, FIRST_COLUMN] = np.minimum.reduceat(rows[:, FIRST_COLUMN], starts)
+        merged_rows += len(starts)
+    return merged[:merged_rows]
+
+class SpillingAggregator:
+    # aggregate_bdc_chunks with a spill threshold. Each chunk is reduced to integer-coded tiers sorted by key
+    # (56 bytes a tier) and the partials are merged together every fold_every chunks; when RSS passes the
+    # threshold they are written to disk as one sorted run and dropped. At the end the spilled runs and what
+    # is left in memory are k-way merged and the tiers put back in order of first appearance, giving the
+    # same tier table as aggregate_bdc_chunks.
+    def __init__(self, county_mapping, spill_threshold, fold_every=16):
+        self.county_mapping = county_mapping
+        self.spill_threshold = spill_threshold
+        self.fold_every = fold_every
+        self.providers = KeyCodes()
+        self.provider_ids = []  # provider_id of each provider's first record, by provider code
+        self.counties = KeyCodes()  # (state key, county key)
+        self.technologies = KeyCodes()
+        self.location_types = KeyCodes()
+        self.speeds = KeyCodes()  # (max download, max upload, low latency)
+
+    def reduce_chunk(self, chunk, offset):
+        # Same record filtering as aggregate_bdc_data; `offset` is the ordinal of the chunk's first record
+        missing = [column for column in REQUIRED_BDC_COLUMNS if column not in chunk.columns]
+        if missing:
+            logging.error(f"Missing key in BDC location data: {missing}")
+            return None
+        if chunk.empty:
+            return None
+        codes, state_keys, county_keys = resolve_counties(chunk['block_geoid'], self.county_mapping)
+        resolved = np.array([key is not None for key in state_keys] + [False])
+        keep = resolved[codes]
+        if not keep.any():
+            return None
+        kept = chunk[keep]
+
+        local_counties = codes[keep]
+        used = np.unique(local_counties)
+        county_lookup = np.zeros(len(state_keys), dtype=np.int64)
+        county_lookup[used] = self.counties.encode_uniques([(state_keys[i], county_keys[i]) for i in used.tolist()])
+
+        known_providers = len(self.providers.values)
+        providers = self.providers.encode(kept['brand_name'].to_numpy())
+        if len(self.providers.values) > known_providers:
+            # New providers are coded in order of first appearance, so their first records come in code order
+            new_codes, first_rows = np.unique(providers, return_index=True)
+            provider_ids = kept['provider_id'].to_numpy()
+            self.provider_ids.extend(provider_ids[first_rows[new_codes >= known_providers]].tolist())
+
+        # Speed tiers are factorized column by column, then as one packed code
+        speed_columns = [pd.factorize(kept[column].to_numpy(), use_na_sentinel=False) for column in
+                         ('max_advertised_download_speed', 'max_advertised_upload_speed', 'low_latency')]
+        packed = np.zeros(len(kept), dtype=np.int64)
+        for codes, uniques in speed_columns:
+            packed = packed * len(uniques) + codes
+        speed_codes, packed_uniques = pd.factorize(packed)
+        speed_uniques = []
+        for codes, uniques in reversed(speed_columns):
+            speed_uniques.append(uniques[packed_uniques % len(uniques)].tolist())
+            packed_uniques = packed_uniques // len(uniques)
+        speed_uniques = list(zip(*reversed(speed_uniques)))
+        keys = [
+            providers,
+            county_lookup[local_counties],
+            self.technologies.encode(kept['technology'].to_numpy()),
+            self.location_types.encode(kept['business_residential_code'].to_numpy()),
+            self.speeds.encode_uniques(speed_uniques)[speed_codes]
+        ]
+        return reduce_rows(keys, np.ones(len(kept), dtype=np.int64), offset + np.flatnonzero(keep))
+
+    def code_counts(self):
+        # Codes only ever grow, so the current counts pack the keys of every run made so far
+        return [len(codes.values) for codes in (self.providers, self.counties, self.technologies, self.location_types, self.speeds)]
+
+    def tier_table(self, tiers):
+        if not len(tiers):
+            return empty_tier_table()
+        # Columns are gathered one at a time into first-appearance order rather than copying the sorted tiers
+        order = np.argsort(tiers[:, FIRST_COLUMN], kind='stable')
+        providers, counties, techs, location_types, speeds = (tiers[order, column] for column in range(KEY_COLUMNS))
+        speed_values = np.array(self.speeds.values, dtype=np.int64)
+        tech_keys = [f"{TECH_ABBR_MAPPING.get(tech, 'Unknown')}, {tech}" for tech in self.technologies.values]
+        return pd.DataFrame({
+            'provider': categorical(self.providers.values, providers),
+            'provider_id': np.array(self.provider_ids, dtype=np.int64)[providers],
+            'state': categorical([state_key for state_key, county_key in self.counties.values], counties),
+            'county': categorical([county_key for state_key, county_key in self.counties.values], counties),
+            'technology': categorical(tech_keys, techs),
+            'location_type': categorical(self.location_types.values, location_types),
+            'max_download_speed': speed_values[speeds, 0],
+            'max_upload_speed': speed_values[speeds, 1],
+            'low_latency': speed_values[speeds, 2],
+            'count': tiers[order, COUNT_COLUMN]
+        })
+
+    def aggregate(self, chunks):
+        if self.spill_threshold.spill_dir is not None:
+            os.makedirs(self.spill_threshold.spill_dir, exist_ok=True)
+        spill_dir = tempfile.mkdtemp(prefix='spill_', dir=self.spill_threshold.spill_dir)
+        try:
+            partials = []
+            spilled = []
+            records = 0
+            warned = False
+            for chunk in chunks:
+                partial = self.reduce_chunk(chunk, records)
+                records += len(chunk)
+                if partial is not None:
+                    partials.append(partial)
+                if len(partials) >= self.fold_every:
+                    partials = [merge_runs(partials, self.code_counts())]
+                if partials and self.spill_threshold.should_spill(sum(partial.nbytes for partial in partials)):
+                    run = merge_runs(partials, self.code_counts())
+                    spilled.append(SpilledRun(os.path.join(spill_dir, f"run_{len(spilled)}.bin"), run))
+                    logging.info(f"Spilled {len(run)} speed tiers ({run.nbytes / 1024 ** 2:.1f} MB) to {spilled[-1].path} at "
+                                 f"RSS {self.spill_threshold.rss() / 1024 ** 2:,.0f} MB, {self.spill_threshold.threshold_mb:,.0f} MB threshold")
+                    partials = []
+                    del run
+                if not warned and self.spill_threshold.rss() > self.spill_threshold.threshold:
+                    # What is left is the raw chunk and the reader, which only a smaller --chunk-size shrinks
+                    logging.warning(f"RSS {self.spill_threshold.rss() / 1024 ** 2:,.0f} MB stays above the {self.spill_threshold.threshold_mb:,.0f} MB "
+                                    f"spill threshold; raw chunks are not spilled, so lower --chunk-size to bring it down")
+                    warned = True
+
+            tiers = merge_runs(spilled + partials, self.code_counts())
+            partials = []
+            tier_table = self.tier_table(tiers)
+        finally:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+        logging.info(f"Aggregated {records} records into {len(tier_table)} speed tiers, merging {len(spilled)} spilled runs")
+        return tier_table
+
+def aggregate_with_spill(chunks, county_mapping, spill_threshold=None):
+    if spill_threshold is None:
+        return aggregate_bdc_chunks(chunks, county_mapping)
+    return SpillingAggregator(county_mapping, spill_threshold).aggregate(chunks)
@@ -0,0 +1,174 @@
+# tables.py
+
+import os
+import logging
+import pandas as pd
+from datetime import datetime
+from aggregate import TIER_TABLE_COLUMNS, CATEGORICAL_COLUMNS, LOCATION_TYPES, build_provider_map, combine_tier_tables, compact_tier_table, empty_tier_table
+from writeout import find_latest_output, read_existing_json
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is only needed for the flat output formats
+    pa = None
+
+# Flat alternatives to the nested JSON: the tier table itself, one row per speed tier, with the repeated
+# provider/state/county/technology strings dictionary-encoded. Arrow files are left uncompressed so they
+# can be memory-mapped; Parquet files are zstd-compressed.
+TABLE_FORMATS = {
+    'parquet': '.parquet',
+    'arrow': '.arrow'
+}
+
+def tier_table_schema():
+    fields = []
+    for column in TIER_TABLE_COLUMNS:
+        if column in CATEGORICAL_COLUMNS:
+            fields.append(pa.field(column, pa.dictionary(pa.int32(), pa.string())))
+        elif column in ('max_download_speed', 'max_upload_speed'):
+            fields.append(pa.field(column, pa.int32()))
+        elif column == 'low_latency':
+            fields.append(pa.field(column, pa.int8()))
+        else:
+            fields.append(pa.field(column, pa.int64()))
+    return pa.schema(fields)
+
+def get_table_output_file(output_dir, output_format):
+    return os.path.join(output_dir, f"fccbdcsum_{datetime.now().strftime('%m%d%Y')}{TABLE_FORMATS[output_format]}")
+
+def find_latest_table(output_dir):
+    latest_file = None
+    latest_date = None
+    if not os.path.exists(output_dir):
+        return None
+    for filename in os.listdir(output_dir):
+        if filename.startswith("fccbdcsum_") and filename[18:] in TABLE_FORMATS.values():
+            file_date = datetime.strptime(filename[10:18], '%m%d%Y')
+            if latest_date is None or file_date > latest_date:
+                latest_date = file_date
+                latest_file = filename
+    return os.path.join(output_dir, latest_file) if latest_file else None
+
+def write_tier_table(tier_table, output_file, output_format):
+    if pa is None:
+        raise ImportError("Parquet and Arrow output require pyarrow: pip install pyarrow")
+    # Categoricals come through as dictionary arrays, so each distinct string is stored once
+    table = pa.Table.from_pandas(compact_tier_table(tier_table[TIER_TABLE_COLUMNS]), schema=tier_table_schema(), preserve_index=False)
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    temp_file = f"{output_file}.{os.getpid()}.tmp"
+    try:
+        if output_format == 'parquet':
+            pq.write_table(table, temp_file, compression='zstd')
+        else:
+            with pa.OSFile(temp_file, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    os.replace(temp_file, output_file)
+    logging.info(f"Consolidated {output_format} file written to: {output_file}")
+
+def read_tier_table(table_file):
+    if pa is None:
+        raise ImportError("Reading Parquet and Arrow output requires pyarrow: pip install pyarrow")
+    if table_file.endswith(TABLE_FORMATS['parquet']):
+        table = pq.read_table(table_file)
+    else:
+        with pa.memory_map(table_file, 'r') as source:
+            table = pa.ipc.open_file(source).read_all()
+    # Back to the tier table dtypes, so rebuilt maps hold the same Python ints as the JSON
+    tier_table = table.to_pandas()
+    return tier_table.astype({column: 'int64' for column in TIER_TABLE_COLUMNS if column not in CATEGORICAL_COLUMNS})
+
+def load_provider_map(table_file, speed_tiers=False):
+    # The nested provider map the JSON output holds, rebuilt from a flat output. With speed_tiers each
+    # "locations" list is a SpeedTiers, as json.load(..., object_hook=decode_speed_tiers) would give.
+    tier_table = read_tier_table(table_file)
+    if speed_tiers:
+        return build_provider_map(tier_table)
+
+    # Tiers of a written table are already unique per key, so the plain lists are appended to directly
+    # instead of going through SpeedTiers; same nesting and key order as build_provider_map
+    provider_map = {}
+    rows = zip(*(tier_table[column].tolist() for column in TIER_TABLE_COLUMNS))
+    for provider, provider_id, state_key, county_key, tech_key, location_type, max_download_speed, max_upload_speed, low_latency, count in rows:
+        provider_data = provider_map.get(provider)
+        if provider_data is None:
+            provider_data = provider_map[provider] = {"provider_id": provider_id, "states": {}}
+        state_data = provider_data["states"].get(state_key)
+        if state_data is None:
+            state_data = provider_data["states"][state_key] = {"counties": {}}
+        county_data = state_data["counties"].get(county_key)
+        if county_data is None:
+            county_data = state_data["counties"][county_key] = {"total_locations": 0, "technologies": {}}
+        tech_data = county_data["technologies"].get(tech_key)
+        if tech_data is None:
+            tech_data = county_data["technologies"][tech_key] = {
+                "total_locations": 0,
+                "R": {"total_locations": 0, "locations": []},
+                "B": {"total_locations": 0, "locations": []},
+                "X": {"total_locations": 0, "locations": []}
+            }
+        county_data["total_locations"] += count
+        tech_data["total_locations"] += count
+        loc_data = tech_data.get(location_type) if location_type in LOCATION_TYPES else None
+        if loc_data is None:
+            continue
+        loc_data["total_locations"] += count
+        loc_data["locations"].append({
+            "count": count,
+            "max_download_speed": max_download_speed,
+            "max_upload_speed": max_upload_speed,
+            "low_latency": low_latency
+        })
+    return provider_map
+
+def flatten_provider_map(provider_map):
+    # Tier table of a nested provider map, such as a previous JSON output, in the map's key order
+    rows = []
+    for provider, provider_data in provider_map.items():
+        for state_key, state_data in provider_data["states"].items():
+            for county_key, county_data in state_data["counties"].items():
+                for tech_key, tech_data in county_data["technologies"].items():
+                    for location_type in LOCATION_TYPES:
+                        for tier in tech_data.get(location_type, {}).get("locations", []):
+                            if not isinstance(tier, dict):
+                                tier = tier.to_dict()
+                            rows.append((provider, provider_data["provider_id"], state_key, county_key, tech_key, location_type,
+                                         tier["max_download_speed"], tier["max_upload_speed"], tier["low_latency"], tier["count"]))
+    if not rows:
+        return empty_tier_table()
+    return compact_tier_table(pd.DataFrame(rows, columns=TIER_TABLE_COLUMNS))
+
+def output_age(output_file):
+    # Date in the file name, then mtime for outputs written the same day
+    filename = os.path.basename(output_file)
+    return datetime.strptime(filename[10:18], '%m%d%Y'), os.stat(output_file).st_mtime_ns
+
+def find_latest_previous_output(output_dir):
+    # The newer of the latest flat and JSON outputs, which every run merges into whatever its own format,
+    # so a run in one format between two runs in the other is not dropped
+    outputs = [output_file for output_file in (find_latest_table(output_dir), find_latest_output(output_dir)) if output_file]
+    return max(outputs, key=output_age) if outputs else None
+
+def is_table_file(output_file):
+    return output_file.endswith(tuple(TABLE_FORMATS.values()))
+
+def read_existing_tiers(base_dir):
+    # The latest previous output as a tier table
+    latest_file = find_latest_previous_output(os.path.join(base_dir, 'USA_FCC-bdc'))
+    if latest_file and is_table_file(latest_file):
+        logging.info(f"Loading existing data from {os.path.basename(latest_file)}")
+        return read_tier_table(latest_file)
+    return flatten_provider_map(read_existing_json(base_dir))
+
+def write_consolidated_table(tier_table, base_dir, output_dir=None, output_format='parquet'):
+    # Previous tiers come first, so providers, states and tiers keep the order a merged JSON output would have
+    if output_dir is None:
+        output_dir = os.path.join(base_dir, 'USA_FCC-bdc')
+    combined = combine_tier_tables([read_existing_tiers(base_dir), tier_table])
+    output_file = get_table_output_file(output_dir, output_format)
+    write_tier_table(combined, output_file, output_format)
+    return output_file
@@ -2,39 +2,47 @@
 
 import json
 import os
+import gzip
+import numpy as np
 import pandas as pd
-from tqdm import tqdm
-from constant import STATES_AND_TERRITORIES, TECH_ABBR_MAPPING
+from constant import TECH_ABBR_MAPPING
+from resources import load_county_mapping, STATE_NAME_BY_FIPS
+from aggregate import aggregate_bdc_data, build_provider_map, new_tech_data, encode_speed_tiers, decode_speed_tiers
+from readout import IndexedOutput, EncodedProvider, get_index_path, INDEX_VERSION
 from datetime import datetime
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def get_state_info(state_abbr):
-    for fips, abbr, name in STATES_AND_TERRITORIES:
-        if abbr == state_abbr:
-            return fips.zfill(2), abbr, name.replace(' ', '_')  # Ensure FIPS code is zero-padded and spaces are replaced by underscores
-    raise ValueError(f"State abbreviation {state_abbr} not found in STATES_AND_TERRITORIES")
+# File suffix for each supported output compression
+OUTPUT_COMPRESSION = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst'
+}
 
-def load_county_mapping(base_dir):
-    county_mapping = {}
-    file_path = os.path.join(base_dir, 'USA_FCC-bdc', 'resources', 'county_adjacency2024.txt')
-    logging.info(f"Loading county mapping from {file_path}")
+def import_zstandard():
     try:
-        with open(file_path, 'r') as f:
-            for line in f:
-                if line.startswith("County Name"):
-                    continue
-                parts = line.strip().split('|')
-                county_name = parts[0]
-                county_geoid = parts[1]
-                state_fips = county_geoid[:2]
-                county_mapping[county_geoid] = (state_fips, county_name)
-        logging.info("County mapping loaded successfully")
-    except FileNotFoundError as e:
-        logging.error(f"County adjacency file not found: {e}")
-        raise
-    return county_mapping
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd output requires the zstandard package: pip install zstandard")
+    return zstandard
+
+def check_compression(compression):
+    # Called when arguments are parsed, so a missing codec fails before any state is read, not at the final write
+    if compression == 'zstd':
+        import_zstandard()
+
+def open_output(file_path, mode='r'):
+    # Opens a (possibly compressed) output file in text mode, choosing the codec from the suffix
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, mode + 't', encoding='utf-8')
+    if file_path.endswith('.zst'):
+        return import_zstandard().open(file_path, mode + 't', encoding='utf-8')
+    return open(file_path, mode)
+
+def is_output_file(filename):
+    return filename.startswith("fccbdcsum_") and any(filename.endswith('.json' + suffix) for suffix in OUTPUT_COMPRESSION.values())
 
 def transform_bdc_locations(bdc_locations, county_mapping):
     provider_map = {}
@@ -55,7 +63,7 @@ def transform_bdc_locations(bdc_locations, county_mapping):
             if state_fips is None:
                 continue
 
-            state_name = next((name for fips, abbr, name in STATES_AND_TERRITORIES if fips == state_fips), None)
+            state_name = STATE_NAME_BY_FIPS.get(state_fips)
             if state_name is None:
                 continue
 
@@ -77,126 +85,217 @@ def transform_bdc_locations(bdc_locations, county_mapping):
                 "technologies": {}
             })
 
-            tech_data = county_data["technologies"].setdefault(f"{TECH_ABBR_MAPPING.get(tech_abbr, 'Unknown')}, {tech_abbr}", {
-                "total_locations": 0,
-                "R": {
-                    "total_locations": 0,
-                    "locations": []
-                },
-                "B": {
-                    "total_locations": 0,
-                    "locations": []
-                },
-                "X": {
-                    "total_locations": 0,
-                    "locations": []
-                }
-            })
+            tech_data = county_data["technologies"].setdefault(f"{TECH_ABBR_MAPPING.get(tech_abbr, 'Unknown')}, {tech_abbr}", new_tech_data())
 
             county_data["total_locations"] += 1
             tech_data["total_locations"] += 1
             loc_data = tech_data[location_type]
             loc_data["total_locations"] += 1
 
-            # Check if a location with the same speeds and latency already exists
-            existing_location = next((loc for loc in loc_data["locations"] if loc["max_download_speed"] == max_download_speed and loc["max_upload_speed"] == max_upload_speed and loc["low_latency"] == low_latency), None)
-            if existing_location:
-                existing_location["count"] += 1
-            else:
-                loc_data["locations"].append({
-                    "count": 1,
-                    "max_download_speed": max_download_speed,
-                    "max_upload_speed": max_upload_speed,
-                    "low_latency": low_latency
-                })
+            loc_data["locations"].add(max_download_speed, max_upload_speed, low_latency)
         except KeyError as e:
             logging.error(f"Missing key in BDC location data: {e}")
             continue
 
     return provider_map
 
-def read_existing_json(base_dir):
-    output_dir = os.path.join(base_dir, 'USA_FCC-bdc')
+def find_latest_output(output_dir):
     latest_file = None
     latest_date = None
 
     logging.info(f"Reading existing JSON files from {output_dir}")
     try:
         for filename in os.listdir(output_dir):
-            if filename.startswith("fccbdcsum_") and filename.endswith(".json"):
+            if is_output_file(filename):
                 file_date = datetime.strptime(filename[10:18], '%m%d%Y')
                 if latest_date is None or file_date > latest_date:
                     latest_date = file_date
                     latest_file = filename
-
-        if latest_file:
-            with open(os.path.join(output_dir, latest_file), 'r') as f:
-                logging.info(f"Loading existing data from {latest_file}")
-                return json.load(f)
     except FileNotFoundError as e:
         logging.warning(f"No existing JSON files found: {e}")
+    return os.path.join(output_dir, latest_file) if latest_file else None
+
+def read_existing_json(base_dir):
+    latest_file = find_latest_output(os.path.join(base_dir, 'USA_FCC-bdc'))
+    if latest_file:
+        with open_output(latest_file, 'r') as f:
+            logging.info(f"Loading existing data from {os.path.basename(latest_file)}")
+            return json.load(f, object_hook=decode_speed_tiers)
     return {}
 
-def write_consolidated_json(bdc_data, base_dir, output_dir=None):
-    county_mapping = load_county_mapping(base_dir)
-    provider_map = read_existing_json(base_dir)
+def open_existing_output(base_dir):
+    # Prefers the lazy, indexed view of the latest output; falls back to loading it whole. A flat output
+    # newer than the latest JSON is rebuilt into the nested map and merged into instead.
+    from tables import find_latest_previous_output, is_table_file, load_provider_map  # tables imports writeout
+    latest_file = find_latest_previous_output(os.path.join(base_dir, 'USA_FCC-bdc'))
+    if latest_file and is_table_file(latest_file):
+        logging.info(f"Loading existing data from {os.path.basename(latest_file)}")
+        return load_provider_map(latest_file, speed_tiers=True)
+    if latest_file:
+        existing = IndexedOutput.open(latest_file)
+        if existing is not None:
+            logging.info(f"Opened existing data from {os.path.basename(latest_file)} through its index")
+            return existing
+    return read_existing_json(base_dir)
 
-    logging.info("Starting to process BDC data")
-    for _, row in tqdm(bdc_data.iterrows(), desc="Processing records"):
-        provider_data = transform_bdc_locations([row], county_mapping)
-        for provider, data in provider_data.items():
-            if provider not in provider_map:
-                provider_map[provider] = data
-            else:
-                for state_key, state_data in data["states"].items():
-                    provider_state_data = provider_map[provider]["states"].setdefault(state_key, {
-                        "counties": {}
+def merge_provider_data(provider_map, provider_data):
+    for provider, data in provider_data.items():
+        if provider not in provider_map:
+            provider_map[provider] = data
+        else:
+            for state_key, state_data in data["states"].items():
+                provider_state_data = provider_map[provider]["states"].setdefault(state_key, {
+                    "counties": {}
+                })
+                for county, county_data in state_data["counties"].items():
+                    provider_county_data = provider_state_data["counties"].setdefault(county, {
+                        "total_locations": 0,
+                        "technologies": {}
                     })
-                    for county, county_data in state_data["counties"].items():
-                        provider_county_data = provider_state_data["counties"].setdefault(county, {
-                            "total_locations": 0,
-                            "technologies": {}
-                        })
-                        provider_county_data["total_locations"] += county_data["total_locations"]
-                        for tech, tech_data in county_data["technologies"].items():
-                            provider_tech_data = provider_county_data["technologies"].setdefault(tech, {
-                                "total_locations": 0,
-                                "R": {
-                                    "total_locations": 0,
-                                    "locations": []
-                                },
-                                "B": {
-                                    "total_locations": 0,
-                                    "locations": []
-                                },
-                                "X": {
-                                    "total_locations": 0,
-                                    "locations": []
-                                }
-                            })
-                            provider_tech_data["total_locations"] += tech_data["total_locations"]
-                            for loc_type in ["R", "B", "X"]:
-                                if loc_type in tech_data:
-                                    existing_tech_data = provider_tech_data[loc_type]
-                                    new_tech_data = tech_data[loc_type]
-                                    
-                                    # Update total locations
-                                    existing_tech_data["total_locations"] += new_tech_data["total_locations"]
-                                    
-                                    # Update locations list
-                                    for new_loc in new_tech_data["locations"]:
-                                        existing_location = next(
-                                            (loc for loc in existing_tech_data["locations"] 
-                                             if (loc["max_download_speed"] == new_loc["max_download_speed"] and 
-                                                 loc["max_upload_speed"] == new_loc["max_upload_speed"] and 
-                                                 loc["low_latency"] == new_loc["low_latency"])),
-                                            None
-                                        )
-                                        if existing_location:
-                                            existing_location["count"] += new_loc["count"]
-                                        else:
-                                            existing_tech_data["locations"].append(new_loc)
+                    provider_county_data["total_locations"] += county_data["total_locations"]
+                    for tech, tech_data in county_data["technologies"].items():
+                        provider_tech_data = provider_county_data["technologies"].setdefault(tech, new_tech_data())
+                        provider_tech_data["total_locations"] += tech_data["total_locations"]
+                        for loc_type in ["R", "B", "X"]:
+                            if loc_type in tech_data:
+                                existing_tech_data = provider_tech_data[loc_type]
+                                incoming_tech_data = tech_data[loc_type]
+                                
+                                # Update total locations
+                                existing_tech_data["total_locations"] += incoming_tech_data["total_locations"]
+                                
+                                # Update speed tiers
+                                existing_tech_data["locations"].merge(incoming_tech_data["locations"])
+    return provider_map
+
+def write_consolidated_json(bdc_data, base_dir, output_dir=None, indent=2, compression=None):
+    county_mapping = CountyIndex(load_county_mapping(base_dir))
 
+    logging.info("Starting to process BDC data")
+    tier_table = aggregate_bdc_data(bdc_data, county_mapping)
+    logging.info(f"Aggregated {len(bdc_data)} records into {len(tier_table)} speed tiers")
+    write_consolidated_tiers(tier_table, base_dir, output_dir, indent, compression)
+
+def write_consolidated_tiers(tier_table, base_dir, output_dir=None, indent=2, compression=None):
+    provider_map = open_existing_output(base_dir)
+    try:
+        write_providers(iter_merged_providers(tier_table, provider_map), base_dir, output_dir, indent, compression)
+    finally:
+        if isinstance(provider_map, IndexedOutput):
+            provider_map.close()
+
+def get_provider_positions(tier_table):
+    # Row positions of each provider's tiers, providers in order of first appearance
+    if tier_table.empty:
+        return {}
+    codes, uniques = pd.factorize(tier_table['provider'].to_numpy(), use_na_sentinel=False)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.cumsum(np.bincount(codes, minlength=len(uniques)))
+    return {provider: order[start:end] for provider, start, end in zip(uniques.tolist(), np.r_[0, bounds[:-1]], bounds)}
+
+def iter_merged_providers(tier_table, provider_map):
+    # Yields one merged provider at a time: existing providers first, each popped from provider_map once
+    # written, then providers new to this run. Only one provider subtree is decoded or built at any time.
+    # Providers of an indexed previous output that this run does not touch are passed through as text.
+    positions = get_provider_positions(tier_table)
+    for provider in list(provider_map):
+        provider_positions = positions.pop(provider, None)
+        if provider_positions is None and isinstance(provider_map, IndexedOutput):
+            yield provider, provider_map.encoded_provider(provider)
+            continue
+        provider_data = provider_map.pop(provider)
+        if provider_positions is not None:
+            build_provider_map(tier_table.iloc[provider_positions], {provider: provider_data})
+        yield provider, provider_data
+
+    for provider, provider_positions in positions.items():
+        yield provider, build_provider_map(tier_table.iloc[provider_positions])[provider]
+
+def encode_key(key):
+    # Object keys the way json encodes them, including its coercion of non-string keys
+    if isinstance(key, str):
+        return json.dumps(key)
+    return json.dumps({key: 0}, separators=(',', ':'))[1:-3]
+
+def encode_value(value, indent, level):
+    text = json.dumps(value, indent=indent, separators=(',', ':') if indent is None else (',', ': '), default=encode_speed_tiers)
+    if indent is not None and level:
+        # Raw newlines only occur between tokens, so this re-indents the value for its nesting level
+        text = text.replace('\n', '\n' + ' ' * (indent * level))
+    return text
+
+def encode_members(members, indent, level):
+    # Encodes (encoded key, encoded value) pairs as an object at the given nesting level, exactly as
+    # json.dumps would, and returns the text with the offset of each value within it
+    if not members:
+        return '{}', []
+    if indent is None:
+        opening, delimiter, separator, closing = '{', ',', ':', '}'
+    else:
+        inner = '\n' + ' ' * (indent * (level + 1))
+        opening, delimiter, separator, closing = '{' + inner, ',' + inner, ': ', '\n' + ' ' * (indent * level) + '}'
+
+    parts = [opening]
+    position = len(opening)
+    offsets = []
+    for i, (key, value) in enumerate(members):
+        head = (delimiter if i else '') + key + separator
+        parts.append(head)
+        position += len(head)
+        offsets.append(position)
+        parts.append(value)
+        position += len(value)
+    parts.append(closing)
+    return ''.join(parts), offsets
+
+def shift_index(index, shift):
+    # Index entries are [key, offset, length, children]; children is None below the indexed levels
+    return [[key, offset + shift, length, None if children is None else shift_index(children, shift)]
+            for key, offset, length, children in index]
+
+def encode_container(container, indent, level, encode_child):
+    # Encodes a dict whose values are encoded by encode_child(value, level + 1) -> (text, index);
+    # returns the text and an index of its values relative to the text
+    encoded = [(key, *encode_child(value, level + 1)) for key, value in container.items()]
+    text, offsets = encode_members([(encode_key(key), value) for key, value, index in encoded], indent, level)
+    return text, [[key, offset, len(value), None if index is None else shift_index(index, offset)]
+                  for (key, value, index), offset in zip(encoded, offsets)]
+
+def encode_indexed_member(data, member, indent, level, encode_child):
+    # Encodes a dict where only `member` is descended into with encode_child; returns the text and
+    # the index of the member's values relative to the text
+    if not isinstance(data, dict) or not isinstance(data.get(member), dict):
+        return encode_value(data, indent, level), []
+    members = []
+    child_index = []
+    for key, value in data.items():
+        if key == member:
+            value, child_index = encode_container(value, indent, level + 1, encode_child)
+        else:
+            value = encode_value(value, indent, level + 1)
+        members.append((encode_key(key), value))
+    text, offsets = encode_members(members, indent, level)
+    return text, shift_index(child_index, offsets[list(data).index(member)])
+
+def encode_provider(provider_data, indent, level=1):
+    # Provider subtree text plus [[state, offset, length, [[county, offset, length], ...]], ...]
+    def encode_county(county_data, level):
+        return encode_value(county_data, indent, level), None
+
+    def encode_state(state_data, level):
+        return encode_indexed_member(state_data, "counties", indent, level, encode_county)
+
+    text, states = encode_indexed_member(provider_data, "states", indent, level, encode_state)
+    return text, [[state, offset, length, [county[:3] for county in counties]] for state, offset, length, counties in states]
+
+def shift_states(states, shift):
+    return [[state, offset + shift, length, [[county, county_offset + shift, county_length] for county, county_offset, county_length in counties]]
+            for state, offset, length, counties in states]
+
+def write_provider_map(provider_map, base_dir, output_dir=None, indent=2, compression=None):
+    write_providers(provider_map.items(), base_dir, output_dir, indent, compression)
+
+def write_providers(providers, base_dir, output_dir=None, indent=2, compression=None):
     # Create output directory if it doesn't exist
     if output_dir is None:
         output_dir = os.path.join(base_dir, 'USA_FCC-bdc')
@@ -204,10 +303,43 @@ def write_consolidated_json(bdc_data, base_dir, output_dir=None):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     
-    # Write the consolidated JSON file
-    output_file = os.path.join(output_dir, f"fccbdcsum_{datetime.now().strftime('%m%d%Y')}.json")
-    with open(output_file, 'w') as f:
-        json.dump(provider_map, f, indent=2)
+    # Write the consolidated JSON file one provider at a time, with the same bytes json.dump of the whole
+    # map would produce. Written to a temp file and renamed, since the previous output of the same day
+    # may still be read from lazily while this one is written.
+    output_file = os.path.join(output_dir, f"fccbdcsum_{datetime.now().strftime('%m%d%Y')}.json{OUTPUT_COMPRESSION[compression]}")
+    temp_file = f"{output_file}.{os.getpid()}.tmp{OUTPUT_COMPRESSION[compression]}"
+    if indent is None:
+        opening, delimiter, separator, closing = '{', ',', ':', '}'
+    else:
+        opening, delimiter, separator, closing = '{\n' + ' ' * indent, ',\n' + ' ' * indent, ': ', '\n}'
+
+    index = []
+    with open_output(temp_file, 'w') as f:
+        position = 0
+        for provider, provider_data in providers:
+            if isinstance(provider_data, EncodedProvider) and provider_data.indent == indent:
+                text, states = provider_data.text, provider_data.states
+            else:
+                if isinstance(provider_data, EncodedProvider):
+                    provider_data = provider_data.decode()
+                text, states = encode_provider(provider_data, indent)
+            head = (delimiter if index else opening) + encode_key(provider) + separator
+            offset = position + len(head)
+            index.append([provider, offset, len(text), shift_states(states, offset)])
+            f.write(head + text)
+            position = offset + len(text)
+        f.write(closing if index else '{}')
+        position += len(closing if index else '{}')
+    os.replace(temp_file, output_file)
+
+    # Byte offsets are only useful for random access into uncompressed files
+    index_file = get_index_path(output_file)
+    if compression is None:
+        with open(index_file + '.tmp', 'w') as f:
+            json.dump({"version": INDEX_VERSION, "indent": indent, "size": position, "providers": index}, f, separators=(',', ':'))
+        os.replace(index_file + '.tmp', index_file)
+    elif os.path.exists(index_file):
+        os.remove(index_file)
     
     logging.info(f"Consolidated JSON file written to: {output_file}")
 